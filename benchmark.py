@@ -0,0 +1,368 @@
+"""
+micro benchmarks of data paths, compare current implementation with the legacy one
+run with: python -m gogdb.benchmark [name ...]
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import re
+import timeit
+import tracemalloc
+from copy import deepcopy
+import dateutil.parser
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+from .utilities import Response, parse_datetime
+from .gogapi import APIUtility
+from .gogbase import GOGBase
+from .gogproduct import GOGProduct
+
+
+class FakeAioResponse:
+    """ minimal stand-in of aiohttp.ClientResponse used to build Response objects """
+    def __init__(self, body: bytes, content_type: str):
+        self.method = 'GET'
+        self.cookies = {}
+        self.url = URL('https://api.gog.com/v2/games')
+        self.real_url = self.url
+        self.host = self.url.host
+        self.headers = CIMultiDictProxy(CIMultiDict({'Content-Type': content_type}))
+        self.raw_headers = ()
+        self.request_info = None
+        self.version = None
+        self.status = 200
+        self.reason = 'OK'
+        self.__body = body
+
+    async def read(self):
+        return self.__body
+
+
+def make_response(body: bytes, content_type: str = 'application/json'):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(Response.initialize(FakeAioResponse(body, content_type)))
+    finally:
+        loop.close()
+
+
+def fake_catalog_page(items: int):
+    return {
+        'page': 1, 'limit': items, 'pages': 200,
+        '_embedded': {'items': [{
+            '_embedded': {'product': {
+                'id': 1000000000 + i,
+                'title': f'Game Title {i} – Deluxe Édition',
+                'isAvailableForSale': True,
+                'globalReleaseDate': '2015-05-18T00:00:00+03:00',
+                '_links': {'image': {'href': f'https://images.gog.com/{i:040x}{{formatter}}.jpg',
+                                     'formatters': ['glx_logo', 'product_tile', 'ggvgl']}},
+            }, 'tags': [{'id': str(t), 'name': f'tag {t}'} for t in range(8)]},
+            'description': 'lorem ipsum dolor sit amet ' * 20,
+        } for i in range(items)]}
+    }
+
+
+def legacy_json(response: Response):
+    """ Response.json before the bytes fast path """
+    ctype = response.headers.get('Content-Type', '').lower()
+    json_re = re.compile(r'^application/(?:[\w.+-]+?\+)?json')
+    if json_re.match(ctype) is None:
+        raise ValueError(ctype)
+    return json.loads(response.content.decode(response.get_encoding()))
+
+
+def bench_json_decode(number: int = 20):
+    body = json.dumps(fake_catalog_page(2000), ensure_ascii=False).encode('utf-8')
+    response = make_response(body)
+    assert legacy_json(response) == response.json
+
+    legacy = timeit.timeit(lambda: legacy_json(response), number=number) / number
+    current = timeit.timeit(lambda: response.json, number=number) / number
+    return {
+        'payload_bytes': len(body),
+        'legacy_ms': legacy * 1000,
+        'current_ms': current * 1000,
+        'speedup': legacy / current
+    }
+
+
+def fake_prices_data(products: int, countries: int):
+    """ price results like get_price_in_countries gathers before merge, one list per country """
+    results = list()
+    for country in range(countries):
+        code = f'{chr(65 + country // 26 % 26)}{chr(65 + country % 26)}'
+        for prod in range(products):
+            results.append({'product': 1000000000 + prod, 'prices': {code: [{
+                'currency': 'USD', 'isDefault': True, 'basePrice': 999 + prod, 'finalPrice': 499 + prod}]}})
+    return results
+
+
+def legacy_merge_multi_prices_data(prices_data):
+    """ APIUtility.merge_multi_prices_data before the hash-keyed merge """
+    ids = list()
+    ret_prices = list()
+    for price in prices_data:
+        prod_id = price['product']
+        merged_price = price
+        if prod_id not in ids:
+            ids.append(prod_id)
+            temp_list = filter(lambda x: x["product"] == price["product"], prices_data)
+            for i in temp_list:
+                merged_price['prices'] = {**merged_price['prices'], **i['prices']}
+            ret_prices.append(merged_price)
+    return ret_prices
+
+
+def bench_price_merge(products: int = 1000, countries: int = 50,
+                      full_products: int = 10000, full_countries: int = 200):
+    utility = APIUtility()
+    data = fake_prices_data(products, countries)
+    current_result = utility.merge_multi_prices_data(data)
+    current = timeit.timeit(lambda: utility.merge_multi_prices_data(data), number=5) / 5
+    # legacy merge modifies its input, run it last
+    start = timeit.default_timer()
+    legacy_result = legacy_merge_multi_prices_data(data)
+    legacy = timeit.default_timer() - start
+    assert legacy_result == current_result
+
+    full_data = fake_prices_data(full_products, full_countries)
+    full = timeit.timeit(lambda: utility.merge_multi_prices_data(full_data), number=1)
+    return {
+        'entries': len(data),
+        'legacy_ms': legacy * 1000,
+        'current_ms': current * 1000,
+        'speedup': legacy / current,
+        'full_catalog_entries': len(full_data),
+        'full_catalog_ms': full * 1000
+    }
+
+
+def fake_product_data(prod_id: int = 1207658924, screenshots: int = 12, installers: int = 8):
+    """ detail, extend detail and rating payloads in the shape GOGProduct expects """
+    image = {'href': f'https://images.gog.com/{prod_id:040x}{{formatter}}.jpg',
+             'formatters': ['ggvgm', 'ggvgl', 'ggvgl_2x', 'product_tile']}
+    prod_data = {
+        'isUsingDosBox': False,
+        'inDevelopment': {'active': False},
+        'additionalRequirements': '',
+        '_links': {
+            'store': {'href': f'https://www.gog.com/game/game_{prod_id}'},
+            'support': {'href': f'https://www.gog.com/support/game_{prod_id}'},
+            'forum': {'href': f'https://www.gog.com/forum/game_{prod_id}'},
+            'icon': {'href': 'https://images.gog.com/icon.png'},
+            'logo': {'href': 'https://images.gog.com/logo.png'},
+            'requiresGames': [{'href': f'https://api.gog.com/v2/games/{prod_id + 1}'}],
+            'isIncludedInGames': [{'href': f'https://api.gog.com/v2/games/{prod_id + 2}'}],
+        },
+        '_embedded': {
+            'product': {
+                'id': prod_id,
+                'title': ' Game Title – Deluxe Édition ',
+                'isAvailableForSale': True,
+                'isVisibleInCatalog': True,
+                'isInstallable': True,
+                'hasProductCard': True,
+                'globalReleaseDate': '2015-05-18T00:00:00+03:00',
+                'gogReleaseDate': '2015-05-18T21:00:00+00:00',
+                '_links': {'image': image},
+            },
+            'productType': 'GAME',
+            'series': {'id': 1, 'name': 'Series'},
+            'publisher': {'name': 'Publisher'},
+            'developers': [{'name': 'Developer'}, {'name': 'Co-Developer'}],
+            'supportedOperatingSystems': [{'operatingSystem': {'name': name}} for name in ('windows', 'osx', 'linux')],
+            'features': [{'id': f'feature_{i}', 'name': f'Feature {i}'} for i in range(6)],
+            'tags': [{'id': str(i), 'name': f'Tag {i}'} for i in range(10)],
+            'localizations': [{'_embedded': {'language': {'code': code, 'name': code.upper()},
+                                             'localizationScope': {'type': scope}}}
+                              for code in ('en', 'de', 'fr', 'pl', 'ru') for scope in ('text', 'audio')],
+            'screenshots': [{'_links': {'self': {'href': f'https://images.gog.com/sc{i}{{formatter}}.jpg',
+                                                 'formatters': image['formatters']}}} for i in range(screenshots)],
+            'videos': [{'provider': 'youtube', 'videoId': f'v{i}', 'thumbnailId': f'v{i}',
+                        '_links': {'self': {'href': f'https://www.youtube.com/embed/v{i}'},
+                                   'thumbnail': {'href': f'https://img.youtube.com/vi/v{i}/hqdefault.jpg'}}}
+                       for i in range(3)],
+            'editions': [{'id': prod_id + 3}],
+            'bonuses': [{'name': f'Bonus {i}', 'type': {'slug': 'wallpapers', 'name': 'wallpapers'}} for i in range(5)],
+        }
+    }
+    ext_data = {
+        'id': prod_id,
+        'slug': f'game_{prod_id}',
+        'content_system_compatibility': {'windows': True, 'osx': True, 'linux': False},
+        'downloads': {
+            'installers': [{'id': f'installer_{i}', 'name': 'Game Title', 'os': ('windows', 'mac', 'linux')[i % 3],
+                            'language': 'en', 'version': '1.0', 'total_size': 1024 ** 3,
+                            'files': [{'id': f'en{i}installer{j}', 'size': 1024 ** 2} for j in range(4)]}
+                           for i in range(installers)],
+            'bonus_content': [{'id': i, 'name': f'soundtrack {i}', 'count': 1, 'total_size': 1024,
+                               'files': [{'id': i, 'size': 1024}]} for i in range(4)],
+            'patches': [],
+            'language_packs': [],
+        }
+    }
+    rating_data = {'id': prod_id, 'count': 1000, 'value': 4.5}
+    return prod_data, ext_data, rating_data
+
+
+def legacy_to_dict(obj, only=None, exclude=None, with_collections=True, related_objects=False):
+    """ GOGBase.to_dict before the compiled serializer, works on a copy since it rewrites lists in place """
+    def deal_data(value):
+        if isinstance(value, GOGBase):
+            if not with_collections:
+                return None
+            elif related_objects:
+                return value
+            else:
+                return legacy_to_dict(value, with_collections=with_collections, related_objects=related_objects)
+        elif isinstance(value, list):
+            if with_collections:
+                for i in range(0, len(value)):
+                    tmp = deal_data(value[i])
+                    if tmp is not None:
+                        value[i] = tmp
+                return value
+            else:
+                return None
+        elif isinstance(value, dict):
+            if with_collections:
+                for key in value:
+                    tmp = deal_data(value[key])
+                    if tmp is not None:
+                        value[key] = tmp
+                return value
+        elif isinstance(value, str):
+            return value.strip()
+        else:
+            return value
+
+    members = dict(inspect.getmembers(obj))
+    classes = inspect.getmembers(obj, inspect.isclass)
+    properties = inspect.getmembers(classes[0][1], lambda x: isinstance(x, property))
+    properties_dict = dict()
+    for prop in map(lambda x: x[0], properties):
+        if only is not None:
+            if prop not in only:
+                continue
+        elif exclude is not None and prop in exclude:
+            continue
+        value = deal_data(members[prop])
+        if value is None:
+            continue
+        properties_dict[prop] = value
+    return properties_dict
+
+
+def bench_to_dict(number: int = 200):
+    products = [GOGProduct(*fake_product_data()) for _ in range(number)]
+    legacy_products = [GOGProduct(*fake_product_data()) for _ in range(number)]
+    assert legacy_to_dict(deepcopy(products[0])) == products[0].to_dict()
+
+    def run(serialize, objs):
+        # what GOGProduct.save_or_update serializes for one product
+        for product in objs:
+            serialize(product, with_collections=False)
+            for sub_objs in (product.screenshots, product.videos, product.bonuses, product.localizations,
+                             product.downloads['installers'], product.downloads['bonusContent']):
+                for sub_obj in sub_objs:
+                    serialize(sub_obj, with_collections=False)
+                    serialize(sub_obj)
+
+    legacy = timeit.timeit(lambda: run(legacy_to_dict, legacy_products), number=1) / number
+    current = timeit.timeit(lambda: run(GOGBase.to_dict, products), number=1) / number
+    return {
+        'products': number,
+        'legacy_ms': legacy * 1000,
+        'current_ms': current * 1000,
+        'speedup': legacy / current
+    }
+
+
+def bench_product_parse(number: int = 1000):
+    datas = [fake_product_data(1000000000 + i) for i in range(number)]
+
+    def checkout_pass():
+        # read scalar fields only, sub-collections are never built
+        for data in datas:
+            product = GOGProduct(*data)
+            product.to_dict(only=('id', 'title', 'isAvailableForSale', 'isVisibleInCatalog', 'isPreorder'))
+
+    def full_pass():
+        for data in datas:
+            product = GOGProduct(*data)
+            product.to_dict()
+
+    checkout = timeit.timeit(checkout_pass, number=1) / number
+    full = timeit.timeit(full_pass, number=1) / number
+    return {
+        'products': number,
+        'checkout_ms': checkout * 1000,
+        'full_ms': full * 1000,
+        'speedup': full / checkout
+    }
+
+
+def bench_product_memory(number: int = 1000):
+    datas = [fake_product_data(1000000000 + i) for i in range(number)]
+    tracemalloc.start()
+    try:
+        products = [GOGProduct(*data) for data in datas]
+        for product in products:
+            # build every lazy sub-collection, measure the full object graph
+            product.to_dict()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return {
+        'products': len(products),
+        'bytes_per_product': size / number
+    }
+
+
+def bench_date_parse(number: int = 20000, distinct: int = 500):
+    """ release and build dates repeat a lot across the catalog """
+    date_strings = [f'20{10 + i % 10}-0{1 + i % 9}-{10 + i % 18}T{i % 24:02}:00:00+0{i % 4}:00'
+                    for i in range(distinct)]
+    date_strings += [f'2020-01-{10 + i % 18}T10:00:00+0000' for i in range(distinct)]
+    samples = [date_strings[i % len(date_strings)] for i in range(number)]
+    for date_string in date_strings:
+        assert parse_datetime(date_string) == dateutil.parser.parse(date_string).replace(tzinfo=None)
+
+    legacy = timeit.timeit(lambda: [dateutil.parser.parse(x).replace(tzinfo=None) for x in samples], number=1)
+    parse_datetime.cache_clear()
+    current = timeit.timeit(lambda: [parse_datetime(x) for x in samples], number=1)
+    return {
+        'dates': number,
+        'legacy_ms': legacy * 1000,
+        'current_ms': current * 1000,
+        'speedup': legacy / current
+    }
+
+
+benchmarks = {
+    'json': bench_json_decode,
+    'price_merge': bench_price_merge,
+    'to_dict': bench_to_dict,
+    'product_parse': bench_product_parse,
+    'product_memory': bench_product_memory,
+    'date_parse': bench_date_parse,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GOGDB micro benchmarks')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run in {list(benchmarks.keys())}, all by default')
+    args = parser.parse_args()
+    unknown = set(args.names) - set(benchmarks.keys())
+    if unknown:
+        parser.error(f'unknown benchmarks: {unknown}')
+    for name in args.names or benchmarks.keys():
+        result = benchmarks[name]()
+        print(f'{name}: ' + ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                                      for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
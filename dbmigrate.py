@@ -0,0 +1,146 @@
+"""
+migrate databases created by earlier versions to current schema,
+dbmodel.db refuses to generate mapping against a database still needing migration,
+run it once before upgrading:
+    python -m gogdb.dbmigrate sqlite filename=gogdb.sqlite
+    python -m gogdb.dbmigrate postgres user=gogdb password=... host=localhost database=gogdb
+or from code, after bind and before generate_mapping:
+    migrate(DB.db)
+"""
+import argparse
+import logging
+from pony.orm import db_session
+from .gogexceptions import GOGDatabaseException
+
+# bump it and append a step to migrations on every model change existing databases can not follow
+schema_version = 3
+
+logger = logging.getLogger('GOGDB.Migrate')
+
+
+def columns(db, table):
+    """
+    :param db: bound pony Database object, need db_session
+    :param table: table name
+    :return: dict like {<lowercase column name>: <lowercase declared type>}, empty if table not exists
+    """
+    if db.provider.dialect == 'SQLite':
+        rows = db.execute(f'PRAGMA table_info({table})').fetchall()
+        return {row[1].lower(): row[2].lower() for row in rows}
+    if db.provider.dialect == 'PostgreSQL':
+        rows = db.execute('SELECT column_name, data_type FROM information_schema.columns '
+                          f"WHERE table_schema = current_schema() AND table_name = '{table.lower()}'").fetchall()
+        return {row[0].lower(): row[1].lower() for row in rows}
+    raise GOGDatabaseException(f'Migration of {db.provider.dialect} database is not supported')
+
+
+def _detect_version(db):
+    # database created before schema versions were recorded
+    price_columns = columns(db, 'price')
+    if len(price_columns) == 0:
+        return None
+    if price_columns['baseprice'].startswith(('decimal', 'numeric')):
+        return 1
+    if 'payloadhash' not in columns(db, 'game'):
+        return 2
+    return 3
+
+
+def current_version(db):
+    """
+    :param db: bound pony Database object, need db_session
+    :return: schema version of database, None if tables are not created yet
+    """
+    if len(columns(db, 'gogdb_schema')) != 0:
+        return db.execute('SELECT version FROM gogdb_schema').fetchone()[0]
+    return _detect_version(db)
+
+
+def _set_version(db, version):
+    if len(columns(db, 'gogdb_schema')) == 0:
+        db.execute('CREATE TABLE gogdb_schema (version INTEGER NOT NULL)')
+        db.execute(f'INSERT INTO gogdb_schema VALUES ({int(version)})')
+    else:
+        db.execute(f'UPDATE gogdb_schema SET version = {int(version)}')
+
+
+def _prices_to_minor_units(db):
+    # prices were Decimal with two places, every currency GOG sells in uses hundredths
+    for table, column in (('price', 'baseprice'), ('price', 'finalprice'), ('finalpricerecord', 'finalprice')):
+        if db.provider.dialect == 'PostgreSQL':
+            db.execute(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ROUND({column} * 100)')
+        else:
+            # sqlite keeps the declared type, numeric affinity stores the integers as they are
+            db.execute(f'UPDATE {table} SET {column} = CAST(ROUND({column} * 100) AS INTEGER) '
+                       f'WHERE {column} IS NOT NULL')
+
+
+def _add_payload_hash(db):
+    # empty string is what pony stores for an unset Optional(str)
+    db.execute("ALTER TABLE game ADD COLUMN payloadhash TEXT NOT NULL DEFAULT ''")
+
+
+# (version reached, step), in order
+migrations = [
+    (2, _prices_to_minor_units),
+    (3, _add_payload_hash),
+]
+
+
+def migrate(db):
+    """
+    upgrade database to schema_version, every step runs in its own transaction
+    :param db: bound pony Database object, mapping not generated yet
+    """
+    with db_session:
+        version = current_version(db)
+    if version is None:
+        logger.info('Database is empty, nothing to migrate')
+        return
+    for target, step in migrations:
+        if target <= version:
+            continue
+        logger.info(f'Migrate database from schema version {version} to {target}')
+        with db_session:
+            step(db)
+            _set_version(db, target)
+        version = target
+    logger.info(f'Database is at schema version {version}')
+
+
+def check(db):
+    """
+    :param db: bound pony Database object
+    :raise GOGDatabaseException: if database was created by an older schema and needs migrate
+    """
+    with db_session:
+        version = current_version(db)
+    if version is not None and version < schema_version:
+        raise GOGDatabaseException(f'Database schema version {version} is older than {schema_version}, '
+                                   f'run gogdb.dbmigrate first')
+
+
+def stamp(db):
+    """
+    record schema_version into a database whose tables were just created by current models
+    :param db: bound pony Database object
+    """
+    with db_session:
+        if len(columns(db, 'gogdb_schema')) == 0 and len(columns(db, 'price')) != 0:
+            _set_version(db, schema_version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='migrate gogdb database to current schema')
+    parser.add_argument('provider', help='pony provider like sqlite or postgres')
+    parser.add_argument('options', nargs='*', help='bind options like filename=gogdb.sqlite')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    from pony.orm import Database
+    db = Database()
+    db.bind(args.provider, **dict(option.split('=', 1) for option in args.options))
+    migrate(db)
+
+
+if __name__ == '__main__':
+    main()
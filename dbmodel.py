@@ -7,9 +7,21 @@ from hashlib import sha256
 import time
 import collections
 from .crtypes import *
+from .gogcurrency import to_decimal
+from . import dbmigrate
 
 
-db = Database()
+class GOGDatabase(Database):
+    """ refuse to map entities onto a database of an older schema, it needs dbmigrate first """
+    def generate_mapping(self, *args, **kwargs):
+        if self.provider is not None:
+            dbmigrate.check(self)
+        super().generate_mapping(*args, **kwargs)
+        if self.provider is not None:
+            dbmigrate.stamp(self)
+
+
+db = GOGDatabase()
 
 
 class BaseModel(object):
@@ -283,13 +295,17 @@ class Feature(db.Entity, BaseModel):
 
 
 class FinalPriceRecord(db.Entity, BaseModel):
-    """without currency attribute, use USD by default"""
+    """without currency attribute, use USD by default, price in minor units"""
     game = Required(GameDetail)
     country = Required('Country')
     dateTime = Required(datetime)
-    finalPrice = Optional(Decimal)
+    finalPrice = Optional(int, size=64)
     PrimaryKey(game, country, dateTime)
 
+    @property
+    def finalPriceDecimal(self):
+        return to_decimal(self.finalPrice, 'USD')
+
     def insert_callback(self):
         now = datetime.utcnow()
         self.game.id.finalPriceCheckout = now
@@ -300,14 +316,23 @@ class FinalPriceRecord(db.Entity, BaseModel):
 
 
 class Price(db.Entity, BaseModel):
+    """price in minor units of currency"""
     game = Required(GameDetail)
     country = Required('Country')
     currency = Required(str)
-    basePrice = Optional(Decimal)
-    finalPrice = Optional(Decimal)
+    basePrice = Optional(int, size=64)
+    finalPrice = Optional(int, size=64)
     priority = Required(int, default=0)
     PrimaryKey(game, country, currency)
 
+    @property
+    def basePriceDecimal(self):
+        return to_decimal(self.basePrice, self.currency)
+
+    @property
+    def finalPriceDecimal(self):
+        return to_decimal(self.finalPrice, self.currency)
+
     def insert_callback(self):
         now = datetime.utcnow()
         self.game.id.priceCheckout = now
@@ -340,8 +365,8 @@ class Price(db.Entity, BaseModel):
                 change_id.record(CRArgs.wrap_args(CRTypes.BASEPRICE_CHANGE,
                                                   self.game.id, 'basePrice',
                                                   self.country,
-                                                  changed_dict['basePrice'],
-                                                  self.basePrice, self.currency))
+                                                  to_decimal(changed_dict['basePrice'], self.currency),
+                                                  self.basePriceDecimal, self.currency))
 
 
 class Localization(db.Entity, BaseModel):
@@ -752,6 +777,8 @@ class Game(db.Entity, BaseModel):
     finalPriceUpdate = Optional(datetime)
     buildsCheckout = Optional(datetime)
     buildsUpdate = Optional(datetime)
+    # sha256 of detail, extend detail and rating payloads saved last time
+    payloadHash = Optional(str)
     changeRecords = Set(ChangeRecord)
     requiredByGames = Set(GameDetail, reverse='requiresGames')
     requiresGames = Set(GameDetail, reverse='requiredByGames')
@@ -7,6 +7,8 @@ from pony import orm
 
 
 class AchievementRarityLevel(GOGBase):
+    __slots__ = ('__slug', '__desc')
+
     def __init__(self, slug, desc):
         self.__slug = slug
         self.__desc = desc
@@ -24,6 +26,8 @@ class AchievementRarityLevel(GOGBase):
 
 
 class Achievement(GOGBase):
+    __slots__ = ('__id', '__key', '__visible', '__name', '__desc', '__unlocked_image', '__locked_image', '__rarity',
+                 '__rarity_level')
 
     def __init__(self, achi_data):
         self.__id = achi_data['achievement_id']
@@ -80,6 +84,8 @@ class Achievement(GOGBase):
 
 
 class AchievementsTable(GOGBase, GOGNeedNetworkMetaClass):
+    __slots__ = ('client_id', '__total_count', '__mode', '__achievements')
+
     def __init__(self, client_id, achis_data):
         self.client_id = client_id
         self.__total_count = achis_data['total_count']
@@ -91,13 +97,29 @@ class AchievementsTable(GOGBase, GOGNeedNetworkMetaClass):
         achis_data = await gogapi.get_product_achievement(client_id, user_id, token_type, access_token)
         return AchievementsTable(client_id, achis_data)
 
+    @classmethod
+    async def create_pooled(cls, client_id, token_pool):
+        """
+        :param token_pool: gogtoken.TokenPool object, request with any usable account in it
+        """
+        achis_data = await token_pool.request(
+            lambda token: gogapi.get_product_achievement(client_id, token.user_id, token.token_type,
+                                                         token.access_token, token_pool.retry_policy))
+        return AchievementsTable(client_id, achis_data)
+
+    @classmethod
+    async def create_multi_pooled(cls, client_ids: list, token_pool):
+        coro_pool = CoroutinePool(coro_list=(AchievementsTable.create_pooled(client_id, token_pool)
+                                             for client_id in client_ids))
+        return await coro_pool.run_all()
+
     @classmethod
     async def create_multi(cls, client_ids: list, user_id, token_type, access_token):
-        coro_pool = CoroutinePool(coro_list=[AchievementsTable.create(client_id,
+        coro_pool = CoroutinePool(coro_list=(AchievementsTable.create(client_id,
                                                                       user_id,
                                                                       token_type,
                                                                       access_token)
-                                             for client_id in client_ids])
+                                             for client_id in client_ids))
         return await coro_pool.run_all()
 
     @property
@@ -2,11 +2,15 @@
 # encoding: utf-8
 
 import logging
+import asyncio
 import html5lib
+from collections import deque
 from datetime import datetime
 from decimal import Decimal
-from .utilities import Requester, CoroutinePool
+from .utilities import Requester, CoroutinePool, RetryPolicy, session_pool, rate_limiter, retry_metrics, \
+    single_flight
 from .gogexceptions import *
+from .gogcache import validator_cache
 
 
 class APIUtility:
@@ -16,31 +20,49 @@ class APIUtility:
 
     def price_parse(self, price_string):
         """
-        format price string into dict
+        parse price string into integer minor units
         :param price_string: price string format like "999 USD"
-        :return: Decimal object
+        :return: int like 999, use gogcurrency.to_decimal to present it
         """
-        self.__logger.debug(f'parse price from {price_string}')
-        price_tmp = price_string.strip().split(' ')
-        price_tmp[0] = price_tmp[0][:len(price_tmp[0])-2] + '.' + price_tmp[0][len(price_tmp[0])-2:]
-        return Decimal(price_tmp[0]).quantize(Decimal('.00'))
+        return int(price_string.strip().split(' ', 1)[0])
 
-    def merge_multi_prices_data(self, prices_data):
+    def extend_detail_parse(self, detail):
+        """
+        pick fields needed from product of api.gog.com/products
+        :param detail: product json with downloads expanded
+        :return: dict with id, slug, content_system_compatibility and downloads
+        """
+        return {
+            'id': detail['id'],
+            'slug': detail['slug'],
+            'content_system_compatibility': detail['content_system_compatibility'],
+            'downloads': detail['downloads']
+        }
+
+    def index_prices_data(self, prices_data):
+        """
+        index price results of get_price_in_country by product and country in one pass
+        :param prices_data: list of {'product':<id>, 'prices':{<country>:[<price>, ...]}}
+        :return: dict like {<product id>: {<country>: [<price>, ...]}}, input is not modified
+        """
         self.__logger.debug(f'Called')
-        ids = list()
-        ret_prices = list()
+        index = dict()
         for price in prices_data:
-            prod_id = price['product']
-            merged_price = price
-            if prod_id not in ids:
-                ids.append(prod_id)
-                temp_list = filter(lambda x: x["product"] == price["product"], prices_data)
-                for i in temp_list:
-                    merged_price['prices'] = {**merged_price['prices'], **i['prices']}
-                ret_prices.append(merged_price)
-            else:
-                continue
-        return ret_prices
+            countries = index.get(price['product'])
+            if countries is None:
+                countries = index[price['product']] = dict()
+            countries.update(price['prices'])
+        return index
+
+    def merge_multi_prices_data(self, prices_data):
+        """
+        merge price results of different countries by product
+        :param prices_data: list of {'product':<id>, 'prices':{<country>:[<price>, ...]}}
+        :return: list of {'product':<id>, 'prices':{<country>:[<price>, ...], ...}} in first appearance order
+        """
+        self.__logger.debug(f'Called')
+        return [{'product': prod_id, 'prices': prices}
+                for prod_id, prices in self.index_prices_data(prices_data).items()]
 
 
 class API:
@@ -94,6 +116,19 @@ class API:
 
         self.__utl = APIUtility()
 
+        # max product ids in one multi-price request
+        self.__price_batch_size = 50
+        # max product ids in one extend detail request
+        self.__extend_detail_batch_size = 50
+
+    async def close(self):
+        """
+        close the shared http session of current event loop
+        call it once the crawler finished
+        """
+        await session_pool.close()
+        validator_cache.close()
+
     @property
     def logger(self):
         return self.__logger
@@ -102,6 +137,46 @@ class API:
     def hosts(self):
         return self.__hosts
 
+    @property
+    def price_batch_size(self):
+        return self.__price_batch_size
+
+    @property
+    def extend_detail_batch_size(self):
+        return self.__extend_detail_batch_size
+
+    @property
+    def rate_limits(self):
+        """
+        live rate and concurrency limits of every requested host
+        :return: dict like {<host>: {'rate':..., 'concurrency':..., 'in_flight':..., 'latency':...}}
+        """
+        return rate_limiter.limits
+
+    @property
+    def retry_metrics(self):
+        """
+        retry statistics of all requests
+        :return: dict like {'retries':..., 'sleep_time':..., 'gave_up':...}
+        """
+        return retry_metrics.to_dict()
+
+    @property
+    def cache_stats(self):
+        """
+        conditional request statistics
+        :return: dict like {'hits':<304 responses>, 'misses':..., 'total_size':<cached bytes>}
+        """
+        return validator_cache.to_dict()
+
+    @property
+    def coalesce_stats(self):
+        """
+        request coalescing statistics
+        :return: dict like {'hits':<requests saved>, 'misses':<requests sent>, 'in_flight':...}
+        """
+        return single_flight.to_dict()
+
     async def get_total_num(self):
         self.__logger.debug(f"Called")
         async with Requester() as req:
@@ -124,30 +199,79 @@ class API:
 
             return limit * (pages - 1) + lst_num
 
-    async def get_product_id_in_page(self, page, limit=50):
-        self.__logger.debug(f"Called")
+    async def get_catalog_page(self, page, limit=50):
+        """
+        get one page of catalog
+        :param page: page number, start from 1
+        :param limit: products per page
+        :return: return format like this
+                    {
+                        'page':<page number>,
+                        'pages':<total page number>,
+                        'ids':[<product id>, ...],
+                        'products':[<embedded product summary>, ...]
+                    }
+        """
+        self.__logger.debug(f"Called, page={page}")
         params = {'page': page, 'limit': limit, 'locale': 'en-US'}
         async with Requester() as req:
             page_data = await req.get_json(self.hosts['detail'], params=params)
 
             try:
+                pages = page_data['pages']
                 items = page_data['_embedded']['items']
             except Exception as e:
                 self.__logger.error(f"{type(e).__name__} {e}")
                 raise
 
-            result = list()
+            products = list()
             for item in items:
                 try:
-                    result.append(item['_embedded']['product']['id'])
+                    products.append(item['_embedded']['product'])
                 except Exception as e:
                     self.__logger.error(f"{type(e).__name__} {e}")
                     raise
-            return result
+            return {
+                'page': page,
+                'pages': pages,
+                'ids': [product['id'] for product in products],
+                'products': products
+            }
+
+    async def iter_catalog(self, start_page=1, limit=50, prefetch=4):
+        """
+        iterate catalog page by page, yield every page as soon as it arrives in page order
+        at most `prefetch` pages are requested ahead of the consumer
+        :param start_page: page to start from, pass last yielded 'page' + 1 to resume
+        :param limit: products per page
+        :param prefetch: pages requested ahead
+        :return: async generator of page dict, see get_catalog_page
+        """
+        self.__logger.debug(f"Called, start_page={start_page}")
+        first_page = await self.get_catalog_page(start_page, limit)
+        pages = first_page['pages']
+        yield first_page
+
+        pending = deque()
+        next_page = start_page + 1
+        try:
+            while next_page <= pages or len(pending) > 0:
+                while next_page <= pages and len(pending) < prefetch:
+                    pending.append(asyncio.ensure_future(self.get_catalog_page(next_page, limit)))
+                    next_page += 1
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_product_id_in_page(self, page, limit=50):
+        self.__logger.debug(f"Called")
+        page_data = await self.get_catalog_page(page, limit)
+        return page_data['ids']
 
     async def get_product_id_in_pages(self, pages: list, limit=50):
         self.__logger.debug(f"Called")
-        coro_pool = CoroutinePool(coro_list=[self.get_product_id_in_page(page, limit) for page in pages])
+        coro_pool = CoroutinePool(coro_list=(self.get_product_id_in_page(page, limit) for page in pages))
         return await coro_pool.run_all()
 
     async def get_all_product_id(self):
@@ -171,17 +295,17 @@ class API:
 
         async with Requester() as request:
             try:
-                return await request.get_json(url, params)
+                return await request.get_json(url, params, conditional=True)
             except GOGNotFound:
                 raise GOGProductNotFound(product_id)
             except Exception:
                 raise
 
-    async def get_product_achievement(self, client_id, user_id, token_type, access_token):
+    async def get_product_achievement(self, client_id, user_id, token_type, access_token, retry_policy=None):
         self.__logger.debug(f"Called")
         url = self.__hosts['achievement'].replace('{clientid}', client_id).replace('{userid}', user_id)
         headers = {'Authorization': f'{token_type.title()} {access_token}'}
-        async with Requester() as request:
+        async with Requester(retry_policy=retry_policy) as request:
             return await request.get_json(url, headers=headers)
 
     async def get_countries(self):
@@ -218,11 +342,49 @@ class API:
                 results.append(ret_data)
             return results
 
-    async def get_price_in_countries(self, product_ids: list, countries: list):
+    async def get_price_in_countries(self, product_ids: list, countries: list, groups=None):
         self.__logger.debug(f"Called, ids={product_ids} countries={countries}")
-        coro_pool = CoroutinePool(coro_list=[self.get_price_in_country(product_ids, country) for country in countries])
-        results = sum(await coro_pool.run_all(), [])
-        return self.__utl.merge_multi_prices_data(results)
+        results = list()
+        async for _, prices_data in self.iter_prices(product_ids, countries, groups=groups):
+            results.extend(prices_data)
+        return results
+
+    async def iter_prices(self, product_ids: list, countries: list, batch_size=None, concurrency=16, groups=None):
+        """
+        get prices of any number of products in countries,
+        ids are split into batches, every batch × country request is scheduled in one pool
+        :param product_ids: product ids
+        :param countries: country codes
+        :param batch_size: max ids per request, default is API.price_batch_size
+        :param concurrency: max requests in flight
+        :param groups: gogprice.PriceGroups object, only fetch one representative of learned price groups,
+                       prices count as evidence of groups only between PriceGroups.begin_crawl and end_crawl
+        :return: async generator of (batch ids, merged prices data) once all countries of a batch arrived
+        """
+        batch_size = self.__price_batch_size if batch_size is None else batch_size
+        product_ids = list(product_ids)
+        plan = None if groups is None else groups.plan(countries)
+        countries = list(countries) if plan is None else plan.countries
+        if len(countries) == 0:
+            return
+        batches = [product_ids[i:i + batch_size] for i in range(0, len(product_ids), batch_size)]
+        self.__logger.debug(f"Called, {len(product_ids)} ids in {len(batches)} batches, {len(countries)} countries")
+
+        coro_pool = CoroutinePool(concurrency=concurrency,
+                                  coro_list=(self.get_price_in_country(batch, country)
+                                             for batch in batches for country in countries))
+        # results come in grid order, so every len(countries) results complete one batch
+        batch_results = list()
+        received = 0
+        async for result in coro_pool.iter_results(return_exceptions=False):
+            batch_results.extend(result)
+            received += 1
+            if received % len(countries) == 0:
+                merged = self.__utl.merge_multi_prices_data(batch_results)
+                if plan is not None:
+                    merged = plan.expand(merged)
+                yield batches[received // len(countries) - 1], merged
+                batch_results = list()
 
     async def get_rating(self, product_id):
         """
@@ -239,7 +401,7 @@ class API:
         url = f"{self.__hosts['rating'].replace('{productid}', str(product_id))}"
 
         async with Requester() as request:
-            rating_data = await request.get_json(url)
+            rating_data = dict(await request.get_json(url, conditional=True))
             rating_data['id'] = product_id
             rating_data['value'] = Decimal(rating_data['value']).quantize(Decimal('.00'))
             return rating_data
@@ -252,24 +414,66 @@ class API:
 
         async with Requester() as request:
             try:
-                detail = await request.get_json(url, params)
-                ret = dict()
-                ret['id'] = detail['id']
-                ret['slug'] = detail['slug']
-                ret['content_system_compatibility'] = detail['content_system_compatibility']
-                ret['downloads'] = detail['downloads']
-                return ret
+                detail = await request.get_json(url, params, conditional=True)
+                return self.__utl.extend_detail_parse(detail)
             except GOGNotFound:
                 raise GOGProductNotFound(product_id)
             except Exception:
                 raise
 
+    async def get_extend_details(self, product_ids: list, concurrency=16):
+        """
+        get extend detail of many products, up to extend_detail_batch_size ids in one request
+        :param product_ids: product ids
+        :param concurrency: max requests in flight
+        :return: dict like {<product id str>: <same as get_extend_detail>},
+                 value is GOGProductNotFound if product not in response, or the exception of its batch
+        """
+        ret = dict()
+        async for _, details in self.iter_extend_details(product_ids, concurrency=concurrency):
+            ret.update(details)
+        return ret
+
+    async def iter_extend_details(self, product_ids: list, concurrency=16):
+        """
+        get extend detail of many products batch by batch, so parsing can overlap with fetching
+        :param product_ids: product ids
+        :param concurrency: max requests in flight
+        :return: async generator of (batch ids, details of batch like get_extend_details) in input order
+        """
+        product_ids = list(product_ids)
+        batch_size = self.__extend_detail_batch_size
+        batches = [product_ids[i:i + batch_size] for i in range(0, len(product_ids), batch_size)]
+        self.__logger.info(f"Called, {len(product_ids)} ids in {len(batches)} batches")
+
+        async def get_batch(batch):
+            params = {'ids': ','.join(str(product_id) for product_id in batch), 'expand': 'downloads',
+                      'locale': 'en-US'}
+            async with Requester() as request:
+                return await request.get_json(self.__hosts['extend_detail'], params, conditional=True)
+
+        coro_pool = CoroutinePool(concurrency=concurrency, coro_list=(get_batch(batch) for batch in batches))
+        batch_index = 0
+        async for result in coro_pool.iter_results():
+            batch = batches[batch_index]
+            batch_index += 1
+            if isinstance(result, BaseException):
+                yield batch, {str(product_id): result for product_id in batch}
+                continue
+            details = dict()
+            for detail in result:
+                details[str(detail['id'])] = self.__utl.extend_detail_parse(detail)
+            for product_id in map(str, batch):
+                if product_id not in details:
+                    details[product_id] = GOGProductNotFound(product_id)
+            yield batch, details
+
     async def get_product_builds(self, product_id, os: str):
         self.__logger.info(f"Called, id={product_id} os={os}")
 
         url = f"{self.__hosts['builds'].replace('{productid}', str(product_id)).replace('{os}', os)}"
         async with Requester() as request:
-            return await request.get_json(url)
+            return await request.get_json(url, conditional=True)
 
     async def login(self, username, passwd):
         """
@@ -317,10 +521,20 @@ class API:
             return token
 
     async def refresh_token(self, rtoken):
+        """
+        :param rtoken: refresh token
+        :return: new token data
+        :raise GOGRefreshRejected: refresh token is invalid or revoked, the account needs to log in again
+        """
         self.__logger.debug(f"Called")
         self.__auth['refresh']['refresh_token'] = rtoken
-        async with Requester() as request:
-            token = await request.get_json(self.__hosts['token'], self.__auth['refresh'])
+        # 400 is invalid_grant of a bad refresh token, retrying it never helps
+        retry_policy = RetryPolicy(fatal_statuses=RetryPolicy.FATAL_STATUSES + (400,))
+        async with Requester(retry_policy=retry_policy) as request:
+            try:
+                token = await request.get_json(self.__hosts['token'], self.__auth['refresh'])
+            except (GOGBadRequest, GOGUnauthorized):
+                raise GOGRefreshRejected()
             token['last_update'] = datetime.utcnow()
             return token
 
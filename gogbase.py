@@ -4,32 +4,57 @@ from . import dbmodel as DB
 
 
 class GOGBase:
+    __slots__ = ()
 
-    def to_dict(self, only=None, exclude=None, with_collections=True, related_objects=False):
-        members = dict(inspect.getmembers(self))
-        classes = inspect.getmembers(self, inspect.isclass)
-        properties = inspect.getmembers(classes[0][1], lambda x: isinstance(x, property))
-        properties = list(map(lambda x: x[0], properties))
+    # property names of every class, and properties to serialize of every (class, only, exclude)
+    __properties = dict()
+    __plans = dict()
 
-        properties_dict = dict()
-        for prop in properties:
+    @classmethod
+    def __get_properties(cls):
+        properties = GOGBase.__properties.get(cls)
+        if properties is None:
+            properties = [name for name, _ in inspect.getmembers(cls, lambda x: isinstance(x, property))]
+            GOGBase.__properties[cls] = properties
+        return properties
+
+    @classmethod
+    def __get_plan(cls, only, exclude):
+        key = (cls,
+               None if only is None else tuple(only),
+               None if exclude is None else tuple(exclude))
+        plan = GOGBase.__plans.get(key)
+        if plan is None:
             if only is not None:
-                if prop not in only:
-                    continue
+                plan = tuple(prop for prop in cls.__get_properties() if prop in only)
+            elif exclude is not None:
+                plan = tuple(prop for prop in cls.__get_properties() if prop not in exclude)
             else:
-                if exclude is not None:
-                    if prop in exclude:
-                        continue
+                plan = tuple(cls.__get_properties())
+            GOGBase.__plans[key] = plan
+        return plan
 
-            value = members[prop]
-            value = self.__deal_data(value, with_collections, related_objects)
+    def to_dict(self, only=None, exclude=None, with_collections=True, related_objects=False):
+        """
+        serialize properties into dict, property list is computed once per class,
+        only properties requested are read, the object itself is not modified
+        :param only: property names to serialize, exclude is ignored if set
+        :param exclude: property names not to serialize
+        :param with_collections: serialize lists, dicts and nested objects
+        :param related_objects: keep nested objects as they are
+        :return: dict
+        """
+        properties_dict = dict()
+        for prop in self.__get_plan(only, exclude):
+            value = self.__deal_data(getattr(self, prop), with_collections, related_objects)
             if value is None:
                 continue
             properties_dict[prop] = value
 
         return properties_dict
 
-    def __deal_data(self, data, with_collections, related_objects):
+    @staticmethod
+    def __deal_data(data, with_collections, related_objects):
         value = data
         if isinstance(value, GOGBase):
             if not with_collections:
@@ -40,20 +65,20 @@ class GOGBase:
                 return value.to_dict(with_collections=with_collections, related_objects=related_objects)
         elif isinstance(value, list):
             if with_collections:
-                for i in range(0, len(value)):
-                    tmp = self.__deal_data(value[i], with_collections, related_objects)
-                    if tmp is not None:
-                        value[i] = tmp
-                return value
+                ret = list()
+                for item in value:
+                    tmp = GOGBase.__deal_data(item, with_collections, related_objects)
+                    ret.append(item if tmp is None else tmp)
+                return ret
             else:
                 return None
         elif isinstance(value, dict):
             if with_collections:
+                ret = dict()
                 for key in value:
-                    tmp = self.__deal_data(value[key], with_collections, related_objects)
-                    if tmp is not None:
-                        value[key] = tmp
-                return value
+                    tmp = GOGBase.__deal_data(value[key], with_collections, related_objects)
+                    ret[key] = value[key] if tmp is None else tmp
+                return ret
         elif isinstance(value, str):
             return value.strip()
         else:
@@ -65,6 +90,7 @@ class GOGBase:
 
 
 class GOGSimpleClass(GOGBase):
+    __slots__ = ('__name',)
 
     @property
     def name(self):
@@ -75,6 +101,7 @@ class GOGSimpleClass(GOGBase):
 
 
 class GOGFile(GOGBase):
+    __slots__ = ('__id', '__filesize', '__downlink')
 
     @property
     def id(self):
@@ -95,6 +122,7 @@ class GOGFile(GOGBase):
 
 
 class GOGDownloadable(GOGBase):
+    __slots__ = ('__id', '__totalSize', '__files')
 
     @property
     def id(self):
@@ -122,6 +150,7 @@ class GOGDownloadable(GOGBase):
 
 
 class GOGNeedNetworkMetaClass(metaclass=ABCMeta):
+    __slots__ = ()
 
     @classmethod
     @abstractmethod
@@ -1,9 +1,9 @@
 from .gogapi import gogapi
 from .gogbase import GOGBase, GOGNeedNetworkMetaClass
-from .utilities import CoroutinePool, Requester
+from .utilities import CoroutinePool, Requester, ZlibStreamDecoder, loads_json, parse_datetime
+from .gogcache import manifest_cache
+import asyncio
 import zlib
-import dateutil.parser
-import json
 from . import dbmodel as DB
 from pony import orm
 from datetime import datetime
@@ -35,6 +35,7 @@ def get_os_obj(pk):
 
 
 class RepoProductV1(GOGBase):
+    __slots__ = ('__standalone', '__game', '__dependencies')
 
     def __init__(self, repo_prod_data):
         self.__standalone = repo_prod_data.get('standalone', False)
@@ -69,6 +70,7 @@ class RepoProductV1(GOGBase):
 
 
 class SupportCommands(GOGBase):
+    __slots__ = ('__product', '__languages', '__argument', '__systems', '__executable')
 
     def __init__(self, repo_supcmd_data):
         self.__product = repo_supcmd_data.get('gameID')
@@ -109,6 +111,7 @@ class SupportCommands(GOGBase):
 
 
 class Redistributable(GOGBase):
+    __slots__ = ('__redist', '__executable', '__argument')
 
     def __init__(self, repo_redist_data):
         self.__redist = repo_redist_data.get('redist')
@@ -137,6 +140,7 @@ class Redistributable(GOGBase):
 
 
 class DepotV1(GOGBase):
+    __slots__ = ('__products', '__languages', '__manifest', '__systems', '__size')
 
     def __init__(self, repo_depot_data):
         self.__products = repo_depot_data.get('gameIDs')
@@ -175,6 +179,8 @@ class DepotV1(GOGBase):
 
 
 class RepoV1(GOGBase):
+    __slots__ = ('__rootGame', '__timestamp', '__products', '__support_commands', '__redists', '__depots',
+                 '__installDirectory', '__projectName')
 
     def __init__(self, repo_data):
         repo_data = repo_data['product']
@@ -254,6 +260,7 @@ class RepoV1(GOGBase):
 
 
 class RepoProductV2(GOGBase):
+    __slots__ = ('__product', '__script', '__temp_args', '__temp_exec')
 
     def __init__(self, repo_prod_data):
         self.__product = repo_prod_data.get('productId')
@@ -284,6 +291,7 @@ class RepoProductV2(GOGBase):
 
 
 class CloudSave(GOGBase):
+    __slots__ = ('__location', '__name')
 
     def __init__(self, cloudsave_data):
         self.__location = cloudsave_data.get('location')
@@ -302,6 +310,7 @@ class CloudSave(GOGBase):
 
 
 class DepotV2(GOGBase):
+    __slots__ = ('__manifest', '__comp_size', '__prod_id', '__languages', '__size', '__is_offline')
 
     def __init__(self, depot_data, isOffline=False):
         self.__manifest = depot_data.get('manifest')
@@ -343,6 +352,8 @@ class DepotV2(GOGBase):
 
 
 class RepoV2(GOGBase):
+    __slots__ = ('__base_prod', '__client_id', '__client_secret', '__install_dir', '__platform', '__tags',
+                 '__dependencies', '__products', '__depots_unmerged', '__depots', '__cloud_saves')
 
     def __init__(self, repo_data):
         self.__base_prod = repo_data.get('baseProductId')
@@ -437,6 +448,8 @@ class RepoV2(GOGBase):
 
 
 class Build(GOGBase, GOGNeedNetworkMetaClass):
+    __slots__ = ('__build_id', '__product_id', '__os', '__branch', '__version', '__tags', '__public',
+                 '__date_published', '__gen', '__legacy_build_id', '__is_default', '__repo_v1', '__repo_v2')
 
     def __init__(self, build_data, isDefault=False):
         self.__build_id = build_data.get('build_id')
@@ -446,7 +459,7 @@ class Build(GOGBase, GOGNeedNetworkMetaClass):
         self.__version = build_data.get('version_name')
         self.__tags = build_data.get('tags')
         self.__public = build_data.get('public', True)
-        self.__date_published = dateutil.parser.parse(build_data.get('date_published')).replace(tzinfo=None)
+        self.__date_published = parse_datetime(build_data.get('date_published'))
         self.__gen = build_data.get('generation')
         self.__legacy_build_id = build_data.get('legacy_build_id', None)
         self.__is_default = isDefault
@@ -469,23 +482,34 @@ class Build(GOGBase, GOGNeedNetworkMetaClass):
         return self
 
     @classmethod
-    async def create_multi(cls, builds_data: list):
-        if len(builds_data) > 0:
-            coro_list = [Build.create(builds_data[0], True)]
-            if len(builds_data) > 1:
-                coro_list.extend([Build.create(build_data) for build_data in builds_data[1:]])
-        else:
-            coro_list = []
+    async def create_multi(cls, builds_data: list, default_build_id=None):
+        # the first build is the default one if default_build_id not given
+        if default_build_id is None and len(builds_data) > 0:
+            default_build_id = builds_data[0].get('build_id')
+        coro_list = (Build.create(build_data, build_data.get('build_id') == default_build_id)
+                     for build_data in builds_data)
         coro_pool = CoroutinePool(coro_list=coro_list)
         return await coro_pool.run_all()
 
     async def __get_repo_data(self, url, gen):
+        cached = manifest_cache.get(url)
+        if cached is not None:
+            return loads_json(cached)
+
         async with Requester() as request:
-            data = await request.get(url)
             if gen == 1:
-                data = json.loads(data.text)
+                data = await request.get(url)
+                manifest_cache.put(url, zlib.compress(data.content))
+                data = loads_json(data.content)
             elif gen == 2:
-                data = json.loads(zlib.decompress(data.content).decode("utf-8"))
+                # decompress while downloading, only the decompressed body is kept,
+                # compress it again for the cache in an executor, large manifests would block the loop
+                data = await request.get(url, decoder=ZlibStreamDecoder)
+                content = data.content
+                caching = asyncio.get_event_loop().run_in_executor(
+                    None, lambda: manifest_cache.put(url, zlib.compress(content)))
+                data = loads_json(content)
+                await caching
             else:
                 data = ValueError('Generation not supported')
 
@@ -551,9 +575,11 @@ class Build(GOGBase, GOGNeedNetworkMetaClass):
 
 
 class BuildsTable(GOGBase, GOGNeedNetworkMetaClass):
+    __slots__ = ('__builds', '__known_builds', '__prod_id')
 
     def __init__(self, prod_id):
         self.__builds = list()
+        self.__known_builds = list()
         self.__prod_id = prod_id
 
     @classmethod
@@ -561,17 +587,29 @@ class BuildsTable(GOGBase, GOGNeedNetworkMetaClass):
         builds_data = await gogapi.get_product_builds(prod_id, os)
         builds_data = builds_data.get('items', [])
         self = BuildsTable(prod_id)
-        self.__builds = await Build.create_multi(builds_data)
+
+        # builds already in database never change, only their default flag needs update
+        default_build_id = builds_data[0].get('build_id') if len(builds_data) > 0 else None
+        known_ids = cls.__get_known_build_ids([build_data.get('build_id') for build_data in builds_data])
+        self.__known_builds = [(build_id, build_id == default_build_id) for build_id in known_ids]
+        new_builds_data = [build_data for build_data in builds_data if build_data.get('build_id') not in known_ids]
+
+        self.__builds = await Build.create_multi(new_builds_data, default_build_id)
         cls.try_exception(*self.__builds)
 
         return self
 
+    @staticmethod
+    def __get_known_build_ids(build_ids):
+        build_ids = [str(build_id) for build_id in build_ids if build_id is not None]
+        if len(build_ids) == 0:
+            return set()
+        with orm.db_session:
+            return set(orm.select(build.buildId for build in DB.Build if build.buildId in build_ids)[:])
+
     @classmethod
     async def create_multi(cls, prod_ids: list, os_list: list):
-        coro_list = list()
-        for prod_id in prod_ids:
-            for os in os_list:
-                coro_list.append(BuildsTable.create(prod_id, os))
+        coro_list = (BuildsTable.create(prod_id, os) for prod_id in prod_ids for os in os_list)
         coro_pool = CoroutinePool(coro_list=coro_list)
         return await coro_pool.run_all()
 
@@ -583,11 +621,20 @@ class BuildsTable(GOGBase, GOGNeedNetworkMetaClass):
     def product(self):
         return self.__prod_id
 
+    @property
+    def knownBuilds(self):
+        """
+        builds already saved in database, skipped when fetching
+        :return: list of (build id, is default) tuple
+        """
+        return self.__known_builds
+
     def save_or_update(self):
-        if len(self.builds) == 0:
+        if len(self.builds) == 0 and len(self.knownBuilds) == 0:
             now = datetime.utcnow()
             DB.Game[self.product].buildsCheckout = now
             DB.Game[self.product].buildsUpdate = now
             return []
         else:
-            return list(map(lambda x: x.save_or_update(), self.builds))
+            known = list(map(lambda x: DB.Build.save_into_db(buildId=x[0], isDefault=x[1]), self.knownBuilds))
+            return known + list(map(lambda x: x.save_or_update(), self.builds))
@@ -0,0 +1,211 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from hashlib import sha256
+from yarl import URL
+
+
+class ValidatorCache:
+    """
+    persistent cache of response validators (ETag / Last-Modified) and bodies,
+    used to send conditional GET requests, bounded by total body size,
+    writes and access times are committed in batches, not per request
+    """
+    def __init__(self, filename: str = 'httpcache.sqlite', max_size: int = 256 * 1024 * 1024,
+                 commit_batch: int = 64, commit_interval: float = 5.0):
+        self.__filename = filename
+        self.__max_size = max_size
+        self.__commit_batch = commit_batch
+        self.__commit_interval = commit_interval
+        self.__conn = None
+        self.__total_size = 0
+        self.__accessed = dict()
+        self.__uncommitted = 0
+        self.__last_commit = time.monotonic()
+        self.__hits = 0
+        self.__misses = 0
+        self.__logger = logging.getLogger('GOGDB.ValidatorCache')
+
+    def __connect(self):
+        if self.__conn is None:
+            self.__conn = sqlite3.connect(self.__filename)
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('PRAGMA synchronous=NORMAL')
+            self.__conn.execute('CREATE TABLE IF NOT EXISTS response ('
+                                'key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                                'content_type TEXT, body BLOB, size INTEGER, access REAL)')
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS response_access ON response (access)')
+            self.__total_size = self.__conn.execute('SELECT COALESCE(SUM(size), 0) FROM response').fetchone()[0]
+        return self.__conn
+
+    @staticmethod
+    def make_key(url, params=None):
+        """
+        build cache key from url and params, params order does not matter
+        :param url: request url
+        :param params: request params
+        :return: key string
+        """
+        url = URL(str(url))
+        if params:
+            url = url.update_query(params)
+        query = '&'.join(f'{k}={v}' for k, v in sorted(url.query.items()))
+        return sha256(f'{url.with_query(None)}?{query}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        get cached entry
+        :param key: key built by make_key
+        :return: dict with etag, last_modified, content_type and body, None if not cached
+        """
+        conn = self.__connect()
+        row = conn.execute('SELECT etag, last_modified, content_type, body FROM response WHERE key = ?',
+                           (key,)).fetchone()
+        if row is None:
+            return None
+        self.__accessed[key] = time.time()
+        self.__maybe_commit()
+        return {
+            'etag': row[0],
+            'last_modified': row[1],
+            'content_type': row[2],
+            'body': row[3]
+        }
+
+    def put(self, key, etag, last_modified, content_type, body):
+        if etag is None and last_modified is None:
+            return
+        if len(body) > self.__max_size:
+            return
+        conn = self.__connect()
+        old = conn.execute('SELECT size FROM response WHERE key = ?', (key,)).fetchone()
+        if old is not None:
+            self.__total_size -= old[0]
+        conn.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (key, etag, last_modified, content_type, body, len(body), time.time()))
+        self.__total_size += len(body)
+        self.__uncommitted += 1
+        self.__evict()
+        self.__maybe_commit()
+
+    def __write_access(self):
+        if len(self.__accessed) != 0:
+            self.__conn.executemany('UPDATE response SET access = ? WHERE key = ?',
+                                    ((access, key) for key, access in self.__accessed.items()))
+            self.__uncommitted += len(self.__accessed)
+            self.__accessed.clear()
+
+    def __maybe_commit(self):
+        if self.__uncommitted + len(self.__accessed) >= self.__commit_batch or \
+                time.monotonic() - self.__last_commit >= self.__commit_interval:
+            self.flush()
+
+    def flush(self):
+        """ write pending access times and commit """
+        if self.__conn is None:
+            return
+        self.__write_access()
+        if self.__uncommitted != 0:
+            self.__conn.commit()
+            self.__uncommitted = 0
+        self.__last_commit = time.monotonic()
+
+    def __evict(self):
+        # drop least recently used entries until the cache fits in max_size
+        if self.__total_size > self.__max_size:
+            # eviction order depends on access times not written yet
+            self.__write_access()
+        while self.__total_size > self.__max_size:
+            rows = self.__conn.execute('SELECT key, size FROM response ORDER BY access LIMIT 64').fetchall()
+            if len(rows) == 0:
+                self.__total_size = 0
+                break
+            for key, size in rows:
+                self.__conn.execute('DELETE FROM response WHERE key = ?', (key,))
+                self.__total_size -= size
+                if self.__total_size <= self.__max_size:
+                    break
+            self.__logger.debug(f'Evicted cached responses, total size {self.__total_size}')
+
+    def record(self, unchanged: bool):
+        if unchanged:
+            self.__hits += 1
+        else:
+            self.__misses += 1
+
+    def close(self):
+        if self.__conn is not None:
+            self.flush()
+            self.__conn.close()
+            self.__conn = None
+
+    @property
+    def total_size(self):
+        return self.__total_size
+
+    def to_dict(self):
+        return {
+            'hits': self.__hits,
+            'misses': self.__misses,
+            'total_size': self.__total_size
+        }
+
+
+validator_cache = ValidatorCache()
+
+
+class ManifestCache:
+    """
+    content-addressed on-disk cache of build repository manifests,
+    manifest of a build never changes, so entries never expire,
+    files are stored as zlib compressed json named by sha256 of manifest link
+    """
+    def __init__(self, directory: str = 'manifests'):
+        self.__directory = directory
+        self.__hits = 0
+        self.__misses = 0
+        self.__logger = logging.getLogger('GOGDB.ManifestCache')
+
+    def __path(self, link):
+        digest = sha256(str(link).encode('utf-8')).hexdigest()
+        return os.path.join(self.__directory, digest[:2], digest)
+
+    def get(self, link):
+        """
+        :param link: manifest link
+        :return: decompressed manifest bytes, None if not cached
+        """
+        path = self.__path(link)
+        if not os.path.exists(path):
+            self.__misses += 1
+            return None
+        self.__hits += 1
+        with open(path, 'rb') as manifest_file:
+            return zlib.decompress(manifest_file.read())
+
+    def put(self, link, compressed: bytes):
+        """
+        :param link: manifest link
+        :param compressed: zlib compressed manifest
+        """
+        path = self.__path(link)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to temp file then rename, never leave a truncated manifest,
+        # put may run in executor threads, so the temp file is per thread
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as manifest_file:
+            manifest_file.write(compressed)
+        os.replace(tmp_path, path)
+        self.__logger.debug(f'Cached manifest {link}')
+
+    def to_dict(self):
+        return {
+            'hits': self.__hits,
+            'misses': self.__misses
+        }
+
+
+manifest_cache = ManifestCache()
@@ -0,0 +1,29 @@
+from decimal import Decimal
+
+
+# digits of minor unit of price integers got from GOG,
+# GOG quotes every currency it sells in as hundredths so far, even JPY,
+# unlisted currencies use default_exponent
+default_exponent = 2
+currency_exponents = {
+    'USD': 2, 'EUR': 2, 'GBP': 2, 'AUD': 2, 'CAD': 2, 'CHF': 2, 'DKK': 2, 'NOK': 2,
+    'SEK': 2, 'PLN': 2, 'RUB': 2, 'CNY': 2, 'BRL': 2, 'MXN': 2, 'TRY': 2, 'JPY': 2,
+    'KRW': 2, 'HKD': 2, 'SGD': 2, 'NZD': 2, 'ZAR': 2, 'ARS': 2, 'CLP': 2, 'COP': 2,
+    'PEN': 2, 'UAH': 2, 'KZT': 2, 'INR': 2, 'IDR': 2, 'TWD': 2, 'ILS': 2, 'THB': 2,
+}
+
+
+def currency_exponent(currency: str):
+    return currency_exponents.get(currency, default_exponent)
+
+
+def to_decimal(minor_units, currency: str):
+    """
+    convert integer price into Decimal, only for presentation
+    :param minor_units: price in minor units like 999
+    :param currency: currency code like "USD"
+    :return: Decimal like Decimal('9.99'), None if minor_units is None
+    """
+    if minor_units is None:
+        return None
+    return Decimal(int(minor_units)).scaleb(-currency_exponent(currency))
@@ -19,8 +19,18 @@ class GOGBadRequest(GOGAPIException):
 
 
 class GOGNetworkError(GOGAPIException):
+    def __init__(self, message='Network Error, try again later'):
+        super().__init__(message)
+
+
+class GOGTooManyRequests(GOGNetworkError):
+    def __init__(self):
+        super().__init__('Too Many Requests, slow down')
+
+
+class GOGUnauthorized(GOGNetworkError):
     def __init__(self):
-        super().__init__('Network Error, try again later')
+        super().__init__('Unauthorized, token is invalid or expired')
 
 
 class GOGNotFound(GOGAPIException):
@@ -35,6 +45,12 @@ class GOGResponseError(GOGAPIException):
     def judge_status(cls, exp: ClientResponseError):
         if exp.status == 404:
             return GOGNotFound()
+        elif exp.status == 400:
+            return GOGBadRequest()
+        elif exp.status == 429:
+            return GOGTooManyRequests()
+        elif exp.status in (401, 403):
+            return GOGUnauthorized()
         else:
             return GOGNetworkError()
 
@@ -65,6 +81,16 @@ class GOGAccountError(GOGLoginError):
         super().__init__('GOG Username or Password Error')
 
 
+class GOGRefreshRejected(GOGLoginError):
+    def __init__(self):
+        super().__init__('Refresh token rejected, log in again')
+
+
+class GOGTokenExpired(GOGLoginError):
+    def __init__(self):
+        super().__init__('Access token expired, await get_access_token() in a running event loop')
+
+
 class NeedPrimaryKey(GOGDatabaseException):
     pass
 
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import os
+from random import Random
+from aiohttp import web, hdrs
+from yarl import URL
+
+
+class Corpus:
+    """
+    request/response pairs saved into a gzip compressed json lines file,
+    one line like {"key":..., "status":..., "content_type":..., "body":<base64>}
+    """
+    def __init__(self, filename: str = 'corpus.jsonl.gz'):
+        self.__filename = filename
+        self.__entries = dict()
+        self.__file = None
+
+    @staticmethod
+    def make_key(method, url, params=None):
+        """
+        build corpus key from method, url and params, params order does not matter
+        :return: key string like "GET api.gog.com/products?ids=1,2"
+        """
+        url = URL(str(url))
+        if params:
+            url = url.update_query(params)
+        query = '&'.join(f'{k}={v}' for k, v in sorted(url.query.items()))
+        return f'{method.upper()} {url.host}{url.path}?{query}'
+
+    def load(self):
+        self.__entries = dict()
+        if not os.path.exists(self.__filename):
+            return self
+        with gzip.open(self.__filename, 'rt', encoding='utf-8') as corpus_file:
+            for line in corpus_file:
+                entry = json.loads(line)
+                entry['body'] = base64.b64decode(entry['body'])
+                self.__entries[entry['key']] = entry
+        return self
+
+    def get(self, key):
+        return self.__entries.get(key)
+
+    def add(self, key, status, content_type, body):
+        entry = {'key': key, 'status': status, 'content_type': content_type, 'body': body}
+        self.__entries[key] = entry
+        if self.__file is None:
+            self.__file = gzip.open(self.__filename, 'at', encoding='utf-8')
+        line = dict(entry)
+        line['body'] = base64.b64encode(body).decode('ascii')
+        self.__file.write(json.dumps(line) + '\n')
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def filename(self):
+        return self.__filename
+
+
+class Recorder:
+    """ save every response got by Requester into corpus """
+    def __init__(self, corpus: Corpus):
+        self.__corpus = corpus
+        self.__logger = logging.getLogger('GOGDB.Recorder')
+
+    def record(self, method, url, params, response):
+        """
+        :param method: request method
+        :param url: request url, before rewrite
+        :param params: request params
+        :param response: utilities.Response object
+        """
+        key = Corpus.make_key(method, url, params)
+        self.__logger.debug(f'Record {key}')
+        if response.unchanged:
+            # 304 served from cache, save the cached body as the full response it stands for
+            self.__corpus.add(key, 200, response.headers.get(hdrs.CONTENT_TYPE), response.content)
+        else:
+            self.__corpus.add(key, response.status, response.headers.get(hdrs.CONTENT_TYPE), response.raw_content)
+
+    def close(self):
+        self.__corpus.close()
+
+    @property
+    def corpus(self):
+        return self.__corpus
+
+
+class MockGOGServer:
+    """
+    local stand-in of GOG API, replay responses in corpus
+    with configurable latency, jitter, error rate and 429 injection
+    requests are redirected to http://<host>:<port>/<original host><original path>
+    """
+    def __init__(self, corpus: Corpus, host: str = '127.0.0.1', port: int = 8080,
+                 latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.__corpus = corpus
+        self.__host = host
+        self.__port = port
+        self.__latency = latency
+        self.__jitter = jitter
+        self.__error_rate = error_rate
+        self.__throttle_rate = throttle_rate
+        self.__retry_after = retry_after
+        self.__random = Random(seed)
+        self.__runner = None
+        self.__stats = {'served': 0, 'missing': 0, 'errors': 0, 'throttled': 0}
+        self.__logger = logging.getLogger('GOGDB.MockGOGServer')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{host}/{path:.*}', self.__handle)
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, self.__host, self.__port).start()
+        self.__logger.info(f'Replay {len(self.__corpus)} responses on {self.__host}:{self.__port}')
+        return self
+
+    def install(self, hooks):
+        """
+        redirect requests of every Requester to this server
+        :param hooks: utilities.request_hooks
+        """
+        hooks.set_rewrite(self.rewrite)
+
+    async def stop(self):
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    def rewrite(self, url):
+        """
+        redirect url of real GOG host to this server
+        :param url: original request url
+        :return: url on this server
+        """
+        url = URL(str(url))
+        return str(URL.build(scheme='http', host=self.__host, port=self.__port,
+                             path=f'/{url.host}{url.path}', query_string=url.query_string))
+
+    async def __handle(self, request):
+        delay = self.__latency + self.__random.uniform(-self.__jitter, self.__jitter)
+        await asyncio.sleep(max(delay, 0))
+
+        dice = self.__random.random()
+        if dice < self.__throttle_rate:
+            self.__stats['throttled'] += 1
+            return web.Response(status=429, headers={hdrs.RETRY_AFTER: str(self.__retry_after)})
+        if dice < self.__throttle_rate + self.__error_rate:
+            self.__stats['errors'] += 1
+            return web.Response(status=503)
+
+        url = f'https://{request.match_info["host"]}/{request.match_info["path"]}'
+        entry = self.__corpus.get(Corpus.make_key(request.method, url, request.rel_url.query))
+        if entry is None:
+            self.__stats['missing'] += 1
+            self.__logger.debug(f'Not in corpus: {request.method} {url}')
+            return web.Response(status=404)
+        self.__stats['served'] += 1
+        headers = {}
+        if entry['content_type'] is not None:
+            headers[hdrs.CONTENT_TYPE] = entry['content_type']
+        return web.Response(status=entry['status'], body=entry['body'], headers=headers)
+
+    @property
+    def stats(self):
+        return dict(self.__stats)
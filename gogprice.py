@@ -1,11 +1,19 @@
 from .gogapi import gogapi
 from .gogbase import GOGBase, GOGNeedNetworkMetaClass
 from . import dbmodel as DB
-from datetime import datetime
+from datetime import datetime, timedelta
+from random import Random
+from pony import orm
 from pony.orm import db_session
+import numpy
+import simplejson as json
+import logging
+import os
 
 
 class Country(GOGBase):
+    __slots__ = ('__code', '__name', '__priority')
+
     def __init__(self, country_data):
         self.__code = country_data['code']
         self.__name = country_data['name']
@@ -31,6 +39,8 @@ class Country(GOGBase):
 
 
 class Countries(GOGBase, GOGNeedNetworkMetaClass):
+    __slots__ = ('__countries',)
+
     def __init__(self, countries_data):
         self.__countries = list()
         for country_data in countries_data:
@@ -54,6 +64,7 @@ class Countries(GOGBase, GOGNeedNetworkMetaClass):
 
 
 class SignalPrice(GOGBase):
+    __slots__ = ('__prod_id', '__country_code', '__currency', '__basePrice', '__finalPrice', '__priority')
 
     @property
     def game(self):
@@ -91,7 +102,302 @@ class SignalPrice(GOGBase):
         return DB.Price.save_into_db(**self.to_dict())
 
 
+class PricePlan:
+    """
+    countries to fetch in one run of gogapi.iter_prices,
+    fills in prices of skipped group members and records prices seen into the open crawl
+    """
+    def __init__(self, countries: list, skipped: dict, crawl=None):
+        """
+        :param countries: country codes to fetch
+        :param skipped: representative country code -> country codes copying its prices
+        :param crawl: PriceCrawl object to record into, None if no crawl is open
+        """
+        self.__countries = countries
+        self.__skipped = skipped
+        self.__crawl = crawl
+
+    @property
+    def countries(self):
+        return self.__countries
+
+    def expand(self, price_datas):
+        """
+        learn from merged prices data of one batch and fill in prices of skipped countries
+        :param price_datas: list of {'product':<id>, 'prices':{<country>:[<price>, ...]}}
+        :return: prices data with skipped countries, input is not modified
+        """
+        if self.__crawl is not None:
+            self.__crawl.record(price_datas, self.__countries)
+        if len(self.__skipped) == 0:
+            return price_datas
+        ret = list()
+        for data in price_datas:
+            prices = dict(data['prices'])
+            for representative, members in self.__skipped.items():
+                if representative in prices:
+                    for member in members:
+                        prices[member] = prices[representative]
+            ret.append({'product': data['product'], 'prices': prices})
+        return ret
+
+
+class PriceCrawl:
+    """
+    prices seen by every plan of one full crawl, countries are compared batch by batch,
+    so plans fetching different countries or products can record into the same crawl
+    """
+    def __init__(self):
+        self.__same = dict()
+        self.__apart = dict()
+        self.__products = set()
+
+    def record(self, price_datas, countries):
+        """
+        :param price_datas: merged prices data of one batch
+        :param countries: country codes fetched for the batch
+        """
+        self.__products.update(data['product'] for data in price_datas)
+        signatures = {country: 0 for country in countries}
+        for data in price_datas:
+            for country, prices in data['prices'].items():
+                if country in signatures:
+                    signatures[country] = hash((signatures[country], data['product'],
+                                                tuple((p['currency'], p['isDefault'], p['basePrice'],
+                                                       p['finalPrice']) for p in prices)))
+        by_signature = dict()
+        for country, signature in signatures.items():
+            by_signature.setdefault(signature, set()).add(country)
+        fetched = set(signatures)
+        for group in by_signature.values():
+            for country in group:
+                self.__same.setdefault(country, set()).update(group)
+                self.__apart.setdefault(country, set()).update(fetched - group)
+
+    def together(self, country, other):
+        """ both countries were fetched together and never had different prices """
+        return other in self.__same[country] and other not in self.__apart[country]
+
+    def consistent(self, countries):
+        """
+        no two of countries ever had different prices and each one matched another at least once,
+        spot checks differ between plans, so members of a trusted group are not always fetched together
+        :param countries: country codes fetched at least once
+        """
+        if len(countries) == 1:
+            return True
+        for country in countries:
+            if len(self.__apart[country] & countries) != 0:
+                return False
+            if len((self.__same[country] & countries) - {country}) == 0:
+                return False
+        return True
+
+    @property
+    def countries(self):
+        """ country codes fetched at least once """
+        return set(self.__same)
+
+    @property
+    def products(self):
+        return len(self.__products)
+
+
+class PriceGroups:
+    """
+    countries sharing the same price list, learned from previous crawls,
+    countries with identical prices of every product for stable_crawls crawls form a trusted group,
+    only one representative of a trusted group is fetched, other members copy its prices,
+    a few members are still fetched every crawl as spot check, the group is split once they differ,
+    a crawl is what the caller fetches between begin_crawl and end_crawl,
+    prices fetched outside a crawl use trusted groups but do not count as evidence
+    """
+    def __init__(self, filename: str = 'pricegroups.json', stable_crawls: int = 3,
+                 spot_checks: int = 1, min_products: int = 100, seed=None):
+        """
+        :param filename: file to keep learned groups between runs
+        :param stable_crawls: crawls with identical prices before a group is trusted
+        :param spot_checks: members fetched besides representative of every trusted group
+        :param min_products: crawls with less products do not count as evidence of a group
+        """
+        self.__filename = filename
+        self.__stable_crawls = stable_crawls
+        self.__spot_checks = spot_checks
+        self.__min_products = min_products
+        self.__random = Random(seed)
+        self.__streaks = None
+        self.__crawl = None
+        self.__logger = logging.getLogger('GOGDB.PriceGroups')
+
+    def __load(self):
+        if self.__streaks is None:
+            self.__streaks = dict()
+            if os.path.exists(self.__filename):
+                with open(self.__filename, 'r') as groups_file:
+                    for group in json.load(groups_file):
+                        self.__streaks[frozenset(group['countries'])] = group['streak']
+        return self.__streaks
+
+    def __save(self):
+        tmp_filename = f'{self.__filename}.tmp'
+        with open(tmp_filename, 'w') as groups_file:
+            json.dump([{'countries': sorted(group), 'streak': streak}
+                       for group, streak in self.__streaks.items()], groups_file)
+        os.replace(tmp_filename, self.__filename)
+
+    @property
+    def groups(self):
+        """ trusted groups """
+        return [group for group, streak in self.__load().items() if streak >= self.__stable_crawls]
+
+    def begin_crawl(self):
+        """ start a full crawl, prices fetched until end_crawl count as evidence of groups """
+        if self.__crawl is not None:
+            self.__logger.warning('Crawl already started, prices seen so far are dropped')
+        self.__crawl = PriceCrawl()
+
+    def end_crawl(self):
+        """ end a full crawl, update groups by prices seen and save them """
+        crawl, self.__crawl = self.__crawl, None
+        if crawl is None:
+            return
+        if crawl.products < self.__min_products:
+            self.__logger.info(f'Only {crawl.products} products crawled, price groups unchanged')
+            return
+        streaks = self.__load()
+        fetched_countries = crawl.countries
+
+        learned = dict()
+        checked = set()
+        for group in self.groups:
+            fetched = group & fetched_countries
+            if len(fetched) == 0:
+                learned[group] = streaks[group]
+            elif crawl.consistent(fetched):
+                learned[group] = streaks[group] + 1
+                checked.update(fetched)
+            else:
+                self.__logger.info(f'Price group {sorted(group)} split')
+        candidates = list()
+        for country in sorted(fetched_countries - checked):
+            for candidate in candidates:
+                if all(crawl.together(country, member) for member in candidate):
+                    candidate.add(country)
+                    break
+            else:
+                candidates.append({country})
+        for group in map(frozenset, candidates):
+            if len(group) >= 2:
+                learned[group] = streaks.get(group, 0) + 1
+
+        self.__streaks = learned
+        self.__save()
+        self.__logger.info(f'{len(self.groups)} trusted price groups')
+
+    def plan(self, countries):
+        """
+        plan one fetch, every call gets its own plan, so concurrent fetches do not interfere
+        :param countries: country codes wanted
+        :return: PricePlan object
+        """
+        countries = list(countries)
+        wanted = set(countries)
+        skipped = dict()
+        for group in self.groups:
+            members = sorted(group & wanted)
+            if len(members) < 2:
+                continue
+            representative, others = members[0], members[1:]
+            checks = set(self.__random.sample(others, min(self.__spot_checks, len(others))))
+            skipped[representative] = [country for country in others if country not in checks]
+        skipped_countries = {country for members in skipped.values() for country in members}
+        fetched = [country for country in countries if country not in skipped_countries]
+        self.__logger.info(f'Fetch {len(fetched)} of {len(countries)} countries')
+        return PricePlan(fetched, skipped, self.__crawl)
+
+    def to_dict(self):
+        return {
+            'groups': [sorted(group) for group in self.groups],
+            'crawling': self.__crawl is not None
+        }
+
+
+price_groups = PriceGroups()
+
+
+class PriceRefreshPlanner:
+    """
+    assign every product a price refresh interval and pick products due,
+    invisible and not for sale products are refreshed rarely,
+    preorders, products in development and prices changed often are refreshed at min_interval,
+    the others wait longer the longer their price stays unchanged
+    """
+    def __init__(self, min_interval: timedelta = timedelta(hours=6), max_interval: timedelta = timedelta(days=7),
+                 hidden_interval: timedelta = timedelta(days=30), history: timedelta = timedelta(days=180),
+                 frequent_changes: int = 4, stable_factor: float = 0.25, reference_country: str = 'US'):
+        """
+        :param history: window to count price changes in
+        :param reference_country: country code whose price records count price changes,
+                                  one change writes a record for every country
+        :param frequent_changes: price changes in history window to always refresh at min_interval
+        :param stable_factor: interval is this fraction of time since last price change
+        """
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__hidden_interval = hidden_interval
+        self.__history = history
+        self.__frequent_changes = frequent_changes
+        self.__stable_factor = stable_factor
+        self.__reference_country = reference_country
+        self.__logger = logging.getLogger('GOGDB.PriceRefreshPlanner')
+
+    def interval(self, invisible, for_sale, preorder, in_development, price_checkout, price_update, changes, now):
+        """
+        :param changes: price changes in history window
+        :return: timedelta
+        """
+        if invisible or not for_sale:
+            return self.__hidden_interval
+        if preorder or in_development or changes >= self.__frequent_changes:
+            return self.__min_interval
+        last_change = price_update or price_checkout
+        if last_change is None:
+            return self.__min_interval
+        return min(max((now - last_change) * self.__stable_factor, self.__min_interval), self.__max_interval)
+
+    def due(self, now=None):
+        """
+        products due for price refresh, need db_session
+        :param now: utc datetime, now by default
+        :return: list of product ids, never checked products first, then the most overdue
+        """
+        now = datetime.utcnow() if now is None else now
+        since = now - self.__history
+        country = self.__reference_country
+        changes = dict(orm.select((r.game.id.id, orm.count(r)) for r in DB.FinalPriceRecord
+                                  if r.country.code == country and r.dateTime >= since)[:])
+        rows = orm.select((g.id, g.invisible, g.priceCheckout, g.priceUpdate, d.isAvailableForSale,
+                           d.isPreorder, d.inDevelopment) for g in DB.Game for d in DB.GameDetail if d.id == g)[:]
+
+        due = list()
+        for prod_id, invisible, checkout, update, for_sale, preorder, in_development in rows:
+            if checkout is None:
+                due.append((datetime.min, prod_id))
+                continue
+            deadline = checkout + self.interval(invisible, for_sale, preorder, in_development,
+                                                checkout, update, changes.get(prod_id, 0), now)
+            if deadline <= now:
+                due.append((deadline, prod_id))
+        due.sort()
+        self.__logger.info(f'{len(due)} of {len(rows)} products due for price refresh')
+        return [prod_id for _, prod_id in due]
+
+
+price_refresh_planner = PriceRefreshPlanner()
+
+
 class GOGPrice(GOGBase, GOGNeedNetworkMetaClass):
+    __slots__ = ('__prod_id', '__prices')
 
     def __init__(self, price_data):
         self.__prod_id = price_data['product']
@@ -117,13 +423,46 @@ class GOGPrice(GOGBase, GOGNeedNetworkMetaClass):
 
     @classmethod
     async def create_multi(cls, prod_ids: list, countries: list):
-        price_datas = await gogapi.get_price_in_countries(prod_ids, countries)
+        price_datas = await gogapi.get_price_in_countries(prod_ids, countries, groups=price_groups)
         objects = list()
         GOGPrice.__deal_non_price_prod(prod_ids, price_datas)
         for data in price_datas:
             objects.append(GOGPrice(data))
         return objects
 
+    @classmethod
+    async def create_matrix(cls, prod_ids: list, countries: list):
+        """
+        get prices of products as one PriceMatrix instead of GOGPrice objects
+        :return: PriceMatrix object
+        """
+        price_datas = await gogapi.get_price_in_countries(prod_ids, countries, groups=price_groups)
+        GOGPrice.__deal_non_price_prod(prod_ids, price_datas)
+        return PriceMatrix.from_prices_data(price_datas)
+
+    @classmethod
+    async def iter_create_multi(cls, prod_ids: list, countries: list):
+        """
+        create GOGPrice objects batch by batch, so saving can overlap with fetching
+        :return: async generator of GOGPrice object list
+        """
+        async for batch_ids, price_datas in gogapi.iter_prices(prod_ids, countries, groups=price_groups):
+            GOGPrice.__deal_non_price_prod(batch_ids, price_datas)
+            yield [GOGPrice(data) for data in price_datas]
+
+    @classmethod
+    async def iter_create_due(cls, countries: list, planner=None):
+        """
+        create GOGPrice objects of products due for price refresh only
+        :param planner: PriceRefreshPlanner object, price_refresh_planner by default
+        :return: async generator of GOGPrice object list
+        """
+        planner = price_refresh_planner if planner is None else planner
+        with db_session:
+            prod_ids = planner.due()
+        async for objects in cls.iter_create_multi(prod_ids, countries):
+            yield objects
+
     @staticmethod
     def __deal_non_price_prod(ids, price_datas):
         ids_in_result = list()
@@ -149,3 +488,166 @@ class GOGPrice(GOGBase, GOGNeedNetworkMetaClass):
 
     def save_or_update(self):
         return list(map(lambda x: x.save_or_update(), self.prices))
+
+
+class PriceMatrix:
+    """
+    columnar prices of many products,
+    cell [product, country, currency] holds price in minor units, -1 means no price,
+    default marks the default currency of a country,
+    compare with the last snapshot to write changed cells only
+    """
+    MISSING = -1
+
+    def __init__(self, products, countries, currencies):
+        self.__products = [str(prod) for prod in products]
+        self.__countries = list(countries)
+        self.__currencies = list(currencies)
+        self.__product_index = {prod: i for i, prod in enumerate(self.__products)}
+        self.__country_index = {country: i for i, country in enumerate(self.__countries)}
+        self.__currency_index = {currency: i for i, currency in enumerate(self.__currencies)}
+
+        shape = (len(self.__products), len(self.__countries), len(self.__currencies))
+        self.__base = numpy.full(shape, self.MISSING, dtype=numpy.int64)
+        self.__final = numpy.full(shape, self.MISSING, dtype=numpy.int64)
+        self.__default = numpy.zeros(shape, dtype=bool)
+
+    @staticmethod
+    def to_minor_units(price):
+        return PriceMatrix.MISSING if price is None else price
+
+    def __fill(self, cells):
+        if len(cells) == 0:
+            return
+        rows, cols, curs, base, final, default = zip(*cells)
+        index = (numpy.array(rows), numpy.array(cols), numpy.array(curs))
+        self.__base[index] = base
+        self.__final[index] = final
+        self.__default[index] = default
+
+    @classmethod
+    def from_prices_data(cls, price_datas):
+        """
+        build matrix from merged prices data of API.get_price_in_countries
+        :param price_datas: list of {'product':<id>, 'prices':{<country>:[<price>, ...]}}
+        :return: PriceMatrix object
+        """
+        countries = sorted({country for data in price_datas for country in data['prices']})
+        currencies = sorted({price['currency'] for data in price_datas
+                             for prices in data['prices'].values() for price in prices})
+        self = cls([data['product'] for data in price_datas], countries, currencies)
+
+        cells = list()
+        for row, data in enumerate(price_datas):
+            for country, prices in data['prices'].items():
+                col = self.__country_index[country]
+                for price in prices:
+                    cells.append((row, col, self.__currency_index[price['currency']],
+                                  self.to_minor_units(price['basePrice']),
+                                  self.to_minor_units(price['finalPrice']),
+                                  price['isDefault']))
+        self.__fill(cells)
+        return self
+
+    @classmethod
+    def from_db(cls, prod_ids):
+        """
+        build snapshot of saved prices, need db_session
+        :param prod_ids: product ids
+        :return: PriceMatrix object
+        """
+        ids = [int(prod_id) for prod_id in prod_ids]
+        rows = orm.select((p.game.id.id, p.country.code, p.currency, p.basePrice, p.finalPrice, p.priority)
+                          for p in DB.Price if p.game.id.id in ids)[:]
+        countries = sorted({row[1] for row in rows})
+        currencies = sorted({row[2] for row in rows})
+        self = cls(ids, countries, currencies)
+        self.__fill([(self.__product_index[str(row[0])], self.__country_index[row[1]],
+                      self.__currency_index[row[2]], self.to_minor_units(row[3]),
+                      self.to_minor_units(row[4]), row[5] == 0) for row in rows])
+        return self
+
+    def __reindex(self, other, array, fill):
+        # map cells of other matrix onto axes of this matrix
+        product_pos = numpy.array([other.__product_index.get(p, -1) for p in self.__products], dtype=numpy.int64)
+        country_pos = numpy.array([other.__country_index.get(c, -1) for c in self.__countries], dtype=numpy.int64)
+        currency_pos = numpy.array([other.__currency_index.get(c, -1) for c in self.__currencies], dtype=numpy.int64)
+        found = (product_pos >= 0, country_pos >= 0, currency_pos >= 0)
+
+        result = numpy.full(self.shape, fill, dtype=array.dtype)
+        result[numpy.ix_(*(numpy.nonzero(mask)[0] for mask in found))] = \
+            array[numpy.ix_(product_pos[found[0]], country_pos[found[1]], currency_pos[found[2]])]
+        return result
+
+    def changed(self, previous=None):
+        """
+        find cells to write
+        :param previous: last snapshot, every present cell is changed if None
+        :return: bool array with the shape of this matrix
+        """
+        present = (self.__base != self.MISSING) | (self.__final != self.MISSING)
+        if previous is None:
+            return present
+        return present & ((self.__base != self.__reindex(previous, previous.__base, self.MISSING)) |
+                          (self.__final != self.__reindex(previous, previous.__final, self.MISSING)) |
+                          (self.__default != self.__reindex(previous, previous.__default, False)))
+
+    def changed_cells(self, previous=None):
+        """
+        :param previous: last snapshot
+        :return: list of (product, country, currency, basePrice, finalPrice, isDefault) in minor units
+        """
+        cells = numpy.argwhere(self.changed(previous))
+        return [(self.__products[i], self.__countries[j], self.__currencies[k],
+                 int(self.__base[i, j, k]), int(self.__final[i, j, k]), bool(self.__default[i, j, k]))
+                for i, j, k in cells]
+
+    @property
+    def products(self):
+        return self.__products
+
+    @property
+    def countries(self):
+        return self.__countries
+
+    @property
+    def currencies(self):
+        return self.__currencies
+
+    @property
+    def shape(self):
+        return self.__base.shape
+
+    @property
+    def basePrice(self):
+        return self.__base
+
+    @property
+    def finalPrice(self):
+        return self.__final
+
+    @property
+    def default(self):
+        return self.__default
+
+    def save_or_update(self, previous=None):
+        """
+        write changed cells into database, only bump priceCheckout of unchanged products
+        :param previous: last snapshot, load it from database if None
+        :return: list of DB.Price objects written
+        """
+        if previous is None:
+            previous = PriceMatrix.from_db(self.products)
+        objs = list()
+        changed_products = set()
+        for prod, country, currency, base, final, is_default in self.changed_cells(previous):
+            changed_products.add(prod)
+            objs.append(DB.Price.save_into_db(game=prod, country=country, currency=currency,
+                                              basePrice=None if base == self.MISSING else base,
+                                              finalPrice=None if final == self.MISSING else final,
+                                              priority=0 if is_default else 1))
+        now = datetime.utcnow()
+        for prod in self.products:
+            if prod not in changed_products:
+                DB.Game[prod].priceCheckout = now
+        return objs
@@ -1,14 +1,18 @@
 from .gogapi import gogapi
 from .gogbase import *
 import asyncio
-import dateutil.parser
-from .utilities import get_id_from_url, CoroutinePool
+from .utilities import get_id_from_url, parse_datetime, CoroutinePool
 from . import dbmodel as DB
 from pony import orm
+from pony.orm import db_session
 from datetime import datetime
+from hashlib import sha256
+import simplejson as json
+import logging
 
 
 class Rating(GOGBase):
+    __slots__ = ('__rating', '__count')
 
     @property
     def rating(self):
@@ -29,16 +33,22 @@ class Rating(GOGBase):
 
 
 class Publisher(GOGSimpleClass):
+    __slots__ = ()
+
     def save_or_update(self):
         return DB.Publisher.save_into_db(**self.to_dict())
 
 
 class Developer(GOGSimpleClass):
+    __slots__ = ()
+
     def save_or_update(self):
         return DB.Developer.save_into_db(**self.to_dict())
 
 
 class OS(GOGSimpleClass):
+    __slots__ = ()
+
     def save_or_update(self):
         try:
             return DB.OS[self.name]
@@ -47,6 +57,7 @@ class OS(GOGSimpleClass):
 
 
 class Feature(GOGSimpleClass):
+    __slots__ = ('__id',)
 
     @property
     def id(self):
@@ -61,6 +72,7 @@ class Feature(GOGSimpleClass):
 
 
 class Tag(GOGSimpleClass):
+    __slots__ = ('__id',)
 
     @property
     def id(self):
@@ -75,6 +87,7 @@ class Tag(GOGSimpleClass):
 
 
 class Language(GOGSimpleClass):
+    __slots__ = ('__code',)
 
     @property
     def code(self):
@@ -89,6 +102,7 @@ class Language(GOGSimpleClass):
 
 
 class Localization(GOGBase):
+    __slots__ = ('__language', '__type')
 
     @property
     def language(self):
@@ -110,6 +124,7 @@ class Localization(GOGBase):
 
 
 class Series(GOGSimpleClass):
+    __slots__ = ('__id',)
 
     @property
     def id(self):
@@ -124,6 +139,8 @@ class Series(GOGSimpleClass):
 
 
 class Links(GOGBase):
+    __slots__ = ('__store', '__support', '__forum', '__iconSquare', '__boxArtImage', '__backgroundImage', '__icon',
+                 '__logo', '__galaxyBackgroundImage')
 
     @property
     def store(self):
@@ -179,6 +196,7 @@ class Links(GOGBase):
 
 
 class Images(GOGBase):
+    __slots__ = ('__href', '__formatters')
 
     @property
     def href(self):
@@ -209,6 +227,7 @@ class Images(GOGBase):
 
 
 class Screenshot(Images):
+    __slots__ = ('__id',)
 
     @property
     def id(self):
@@ -234,6 +253,7 @@ class Screenshot(Images):
 
 
 class VideoProvider(GOGBase):
+    __slots__ = ('__provider', '__videoHref', '__thumbnailHref')
 
     @property
     def provider(self):
@@ -261,6 +281,8 @@ class VideoProvider(GOGBase):
 
 
 class Video(GOGBase):
+    __slots__ = ('__id', '__provider', '__videoId', '__thumbnailId')
+
     @property
     def id(self):
         return self.__id
@@ -292,6 +314,7 @@ class Video(GOGBase):
 
 
 class BonusType(GOGBase):
+    __slots__ = ('__slug', '__type')
 
     @property
     def slug(self):
@@ -313,6 +336,7 @@ class BonusType(GOGBase):
 
 
 class Bonus(GOGSimpleClass):
+    __slots__ = ('__type',)
 
     @property
     def type(self):
@@ -332,6 +356,7 @@ class Bonus(GOGSimpleClass):
 
 
 class Installer(GOGDownloadable):
+    __slots__ = ('__name', '__language', '__os', '__version')
 
     @property
     def name(self):
@@ -394,6 +419,7 @@ class Installer(GOGDownloadable):
 
 
 class BonusContent(GOGDownloadable):
+    __slots__ = ('__bonus', '__count')
 
     @property
     def count(self):
@@ -417,6 +443,8 @@ class BonusContent(GOGDownloadable):
 
 
 class LanguagePack(Installer):
+    __slots__ = ()
+
     def save_or_update(self, game):
         dict_data = self.to_dict(with_collections=False)
         dict_data['download'] = GOGDownloadable.get_downloadable_table(game)
@@ -432,6 +460,8 @@ class LanguagePack(Installer):
 
 
 class Patche(Installer):
+    __slots__ = ()
+
     def save_or_update(self, game):
         dict_data = self.to_dict(with_collections=False)
         dict_data['download'] = GOGDownloadable.get_downloadable_table(game)
@@ -446,7 +476,97 @@ class Patche(Installer):
         return patch_obj
 
 
+class PayloadFingerprint:
+    """
+    canonical hash of product payloads, compared with the hash saved in Game,
+    products with unchanged payloads skip parsing and database diff
+    """
+    def __init__(self):
+        self.__skipped = 0
+        self.__changed = 0
+
+    @staticmethod
+    def make(*payloads):
+        """
+        :param payloads: json payloads, key order does not matter
+        :return: sha256 hex string
+        """
+        canonical = json.dumps(payloads, sort_keys=True, separators=(',', ':'), use_decimal=True, default=str)
+        return sha256(canonical.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_saved(prod_ids):
+        """
+        :param prod_ids: product ids
+        :return: dict like {<product id int>: <saved hash>}, products never saved are missing
+        """
+        ids = [int(prod_id) for prod_id in prod_ids]
+        with db_session:
+            return dict(orm.select((g.id, g.payloadHash) for g in DB.Game
+                                   if g.id in ids and g.payloadHash is not None)[:])
+
+    def record(self, unchanged: bool):
+        if unchanged:
+            self.__skipped += 1
+        else:
+            self.__changed += 1
+
+    @property
+    def skipped(self):
+        return self.__skipped
+
+    @property
+    def changed(self):
+        return self.__changed
+
+    def to_dict(self):
+        return {
+            'skipped': self.__skipped,
+            'changed': self.__changed
+        }
+
+
+payload_fingerprint = PayloadFingerprint()
+
+
+class UnchangedProduct:
+    """ stand-in of GOGProduct whose payloads are the same as saved last time """
+    __slots__ = ('__id', '__fingerprint')
+
+    def __init__(self, prod_id, fingerprint):
+        self.__id = int(prod_id)
+        self.__fingerprint = fingerprint
+
+    @property
+    def id(self):
+        return self.__id
+
+    def fingerprint(self):
+        return self.__fingerprint
+
+    def save_or_update(self):
+        DB.Game[self.id].detailCheckout = datetime.utcnow()
+        return DB.Game[self.id]
+
+
 class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
+    """
+    scalar fields are parsed when created, sub-collections like screenshots and downloads
+    are built from the retained raw data on first access and cached
+    """
+    __slots__ = ('__slug', '__content_system_compatibility', '__installers', '__bonusContent', '__patches',
+                 '__languagePacks', '__averageRating', '__id', '__title', '__isAvailableForSale',
+                 '__isVisibleInCatalog', '__isPreorder', '__isVisibleInAccount', '__isInstallable',
+                 '__globalReleaseDate', '__hasProductCard', '__gogReleaseDate', '__isSecret', '__image',
+                 '__productType', '__series', '__publishers', '__developers', '__supportedOS', '__features', '__tags',
+                 '__localizations', '__screenshots', '__videos', '__editions', '__bonuses', '__isUsingDosBox',
+                 '__inDevelopment', '__additionalRequirements', '__links', '__requiresGames', '__requiredByGames',
+                 '__includesGames', '__includedInGames', '__embed', '__links_data', '__ext_data',
+                 '__payloads', '__fingerprint')
+    # properties built from raw data on first access
+    lazy_collections = ('publishers', 'developers', 'supportedOS', 'contentSystemCompatibility', 'features', 'tags',
+                        'localizations', 'requiresGames', 'requiredByGames', 'includesGames', 'includedInGames',
+                        'screenshots', 'videos', 'editions', 'bonuses', 'downloads')
 
     @property
     def id(self):
@@ -502,13 +622,16 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
 
     @property
     def globalReleaseDate(self):
-        return dateutil.parser.parse(self.__globalReleaseDate).replace(tzinfo=None) \
-            if self.__globalReleaseDate is not None else None
+        # parsed on first access
+        if isinstance(self.__globalReleaseDate, str):
+            self.__globalReleaseDate = parse_datetime(self.__globalReleaseDate)
+        return self.__globalReleaseDate
 
     @property
     def gogReleaseDate(self):
-        return dateutil.parser.parse(self.__gogReleaseDate).replace(tzinfo=None) \
-            if self.__gogReleaseDate is not None else None
+        if isinstance(self.__gogReleaseDate, str):
+            self.__gogReleaseDate = parse_datetime(self.__gogReleaseDate)
+        return self.__gogReleaseDate
 
     @property
     def averageRating(self):
@@ -520,30 +643,47 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
 
     @property
     def publishers(self):
+        if self.__publishers is None:
+            self.__publishers = [Publisher(self.__embed.get('publisher'))]
         return self.__publishers
 
     @property
     def developers(self):
+        if self.__developers is None:
+            self.__developers = list(map(lambda x: Developer(x), self.__embed.get('developers', [])))
         return self.__developers
 
     @property
     def supportedOS(self):
+        if self.__supportedOS is None:
+            self.__supportedOS = list(
+                map(lambda x: OS(x['operatingSystem']), self.__embed.get('supportedOperatingSystems', [])))
         return self.__supportedOS
 
     @property
     def contentSystemCompatibility(self):
+        if self.__content_system_compatibility is None:
+            compatibility = self.__ext_data['content_system_compatibility']
+            self.__content_system_compatibility = [OS({'name': os}) for os in compatibility if compatibility[os]]
         return self.__content_system_compatibility
 
     @property
     def features(self):
+        if self.__features is None:
+            self.__features = list(map(lambda x: Feature(x), self.__embed.get('features', [])))
         return self.__features
 
     @property
     def tags(self):
+        if self.__tags is None:
+            self.__tags = list(map(lambda x: Tag(x), self.__embed.get('tags', [])))
         return self.__tags
 
     @property
     def localizations(self):
+        if self.__localizations is None:
+            self.__localizations = list(map(lambda x: Localization(x['_embedded']),
+                                           self.__embed.get('localizations', [])))
         return self.__localizations
 
     @property
@@ -552,30 +692,48 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
 
     @property
     def requiresGames(self):
+        if self.__requiresGames is None:
+            self.__requiresGames = list(
+                map(lambda x: get_id_from_url(x['href']), self.__links_data.get('requiresGames', [])))
         return self.__requiresGames
 
     @property
     def requiredByGames(self):
+        if self.__requiredByGames is None:
+            self.__requiredByGames = list(
+                map(lambda x: get_id_from_url(x['href']), self.__links_data.get('isRequiredByGames', [])))
         return self.__requiredByGames
 
     @property
     def includesGames(self):
+        if self.__includesGames is None:
+            self.__includesGames = list(
+                map(lambda x: get_id_from_url(x['href']), self.__links_data.get('includesGames', [])))
         return self.__includesGames
 
     @property
     def includedInGames(self):
+        if self.__includedInGames is None:
+            self.__includedInGames = list(
+                map(lambda x: get_id_from_url(x['href']), self.__links_data.get('isIncludedInGames', [])))
         return self.__includedInGames
 
     @property
     def screenshots(self):
+        if self.__screenshots is None:
+            self.__screenshots = [Screenshot(i, x) for i, x in enumerate(self.__embed.get('screenshots', []))]
         return self.__screenshots
 
     @property
     def videos(self):
+        if self.__videos is None:
+            self.__videos = [Video(i, x) for i, x in enumerate(self.__embed.get('videos', []))]
         return self.__videos
 
     @property
     def editions(self):
+        if self.__editions is None:
+            self.__editions = list(map(lambda x: str(x['id']), self.__embed.get('editions', [])))
         return self.__editions
 
     @property
@@ -588,10 +746,20 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
 
     @property
     def bonuses(self):
+        if self.__bonuses is None:
+            self.__bonuses = list(map(lambda x: Bonus(x), self.__embed.get('bonuses', [])))
         return self.__bonuses
 
     @property
     def downloads(self):
+        if self.__installers is None:
+            downloads = self.__ext_data.get('downloads', {})
+            self.__installers = list(map(lambda x: Installer(self.slug, x), downloads.get('installers', [])))
+            self.__bonusContent = list(map(lambda x: BonusContent(self.slug, x),
+                                           downloads.get('bonus_content', [])))
+            self.__patches = list(map(lambda x: Patche(self.slug, x), downloads.get('patches', [])))
+            self.__languagePacks = list(map(lambda x: LanguagePack(self.slug, x),
+                                            downloads.get('language_packs', [])))
         return {
             "installers": self.__installers,
             "bonusContent": self.__bonusContent,
@@ -604,6 +772,8 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
             prod_data = args[0]
             prod_ext_data = args[1]
             prod_rating_data = args[2]
+            self.__payloads = (prod_data, prod_ext_data, prod_rating_data)
+            self.__fingerprint = None
             self.__parse_data(prod_data)
             self.__parse_ext_data(prod_ext_data)
             self.__parse_rating_data(prod_rating_data)
@@ -611,24 +781,90 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
             raise TypeError()
 
     @classmethod
-    async def create(cls, prod_id):
-        prod_data, prod_ext_data, prod_rating_data = await asyncio.gather(gogapi.get_product_data(prod_id),
-                                                                          gogapi.get_extend_detail(prod_id),
-                                                                          gogapi.get_rating(prod_id),
-                                                                          return_exceptions=True)
+    async def create(cls, prod_id, prod_ext_data=None, saved_fingerprint=None):
+        """
+        :param prod_ext_data: extend detail already got by API.get_extend_details, fetch it if None
+        :param saved_fingerprint: payload hash saved in Game, read it from database if None
+        :return: GOGProduct object, UnchangedProduct object if payloads are the same as saved
+        """
+        coros = [gogapi.get_product_data(prod_id), gogapi.get_rating(prod_id)]
+        if prod_ext_data is None:
+            coros.append(gogapi.get_extend_detail(prod_id))
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        prod_data, prod_rating_data = results[:2]
+        if prod_ext_data is None:
+            prod_ext_data = results[2]
 
         try:
             cls.try_exception(prod_data, prod_ext_data, prod_rating_data)
         except Exception:
             raise
 
-        return GOGProduct(prod_data, prod_ext_data, prod_rating_data)
+        fingerprint = PayloadFingerprint.make(prod_data, prod_ext_data, prod_rating_data)
+        if saved_fingerprint is None:
+            saved_fingerprint = PayloadFingerprint.get_saved([prod_id]).get(int(prod_id))
+        payload_fingerprint.record(fingerprint == saved_fingerprint)
+        if fingerprint == saved_fingerprint:
+            return UnchangedProduct(prod_id, fingerprint)
+
+        product = GOGProduct(prod_data, prod_ext_data, prod_rating_data)
+        product.__fingerprint = fingerprint
+        return product
 
     @classmethod
     async def create_multi(cls, prod_ids: list):
-        coro_pool = CoroutinePool(coro_list=[GOGProduct.create(prod_id) for prod_id in prod_ids])
+        saved_fingerprints = PayloadFingerprint.get_saved(prod_ids)
+
+        async def creates():
+            # products of a batch start as soon as its extend details arrive
+            async for batch, prod_ext_datas in gogapi.iter_extend_details(prod_ids):
+                for prod_id in batch:
+                    yield GOGProduct.create(prod_id, prod_ext_datas[str(prod_id)],
+                                            saved_fingerprints.get(int(prod_id), ''))
+
+        coro_pool = CoroutinePool(coro_list=creates())
         return await coro_pool.run_all(return_exceptions=True)
 
+    @staticmethod
+    def save_or_update_multi(products):
+        """
+        save products got by create_multi, only bump detailCheckout of unchanged products in one query,
+        need db_session
+        :param products: GOGProduct and UnchangedProduct objects, exceptions are ignored
+        :return: list of results of GOGProduct.save_or_update,
+                 the exception instead if a product could not be parsed or saved, others are still saved
+        """
+        unchanged = [product.id for product in products if isinstance(product, UnchangedProduct)]
+        if len(unchanged) != 0:
+            now = datetime.utcnow()
+            for game in DB.Game.select(lambda g: g.id in unchanged):
+                game.detailCheckout = now
+        results = list()
+        for product in products:
+            if not isinstance(product, GOGProduct):
+                continue
+            try:
+                # sub-collections are parsed lazily, parse all before writing anything of the product
+                product.build_collections()
+                results.append(product.save_or_update())
+            except Exception as e:
+                logging.getLogger('GOGDB.GOGProduct').error(f'Save product {product.id} failed: {e!r}')
+                results.append(e)
+        return results
+
+    def build_collections(self):
+        """ build every lazily parsed sub-collection now, raise if raw data of any is malformed """
+        for name in self.lazy_collections:
+            getattr(self, name)
+
+    def fingerprint(self):
+        """
+        :return: hash of payloads this product is parsed from
+        """
+        if self.__fingerprint is None:
+            self.__fingerprint = PayloadFingerprint.make(*self.__payloads)
+        return self.__fingerprint
+
     def __parse_data(self, data):
         if '_embedded' not in data:
             raise ValueError()
@@ -653,25 +889,18 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
             # embedded segment
             self.__productType = embed.get('productType', 'GAME')
             self.__series = None if 'series' not in embed or embed['series'] is None else Series(embed['series'])
-            self.__publishers = [Publisher(embed.get('publisher'))]
-            self.__developers = list(map(lambda x: Developer(x), embed.get('developers', [])))
-            self.__supportedOS = list(
-                map(lambda x: OS(x['operatingSystem']), embed.get('supportedOperatingSystems', [])))
-            self.__features = list(map(lambda x: Feature(x), embed.get('features', [])))
-            self.__tags = list(map(lambda x: Tag(x), embed.get('tags', [])))
-            self.__localizations = list(map(lambda x: Localization(x['_embedded']), embed.get('localizations', [])))
-
-            def gen_sc(tup_data):
-                i, x = tup_data
-                return Screenshot(i, x)
-            self.__screenshots = list(map(gen_sc, enumerate(embed.get('screenshots', []))))
-
-            def gen_vid(tup_data):
-                i, x = tup_data
-                return Video(i, x)
-            self.__videos = list(map(gen_vid, enumerate(embed.get('videos', []))))
-            self.__editions = list(map(lambda x: str(x['id']), embed.get('editions', [])))
-            self.__bonuses = list(map(lambda x: Bonus(x), embed.get('bonuses', [])))
+            # sub-collections are built from raw data on first access
+            self.__embed = embed
+            self.__publishers = None
+            self.__developers = None
+            self.__supportedOS = None
+            self.__features = None
+            self.__tags = None
+            self.__localizations = None
+            self.__screenshots = None
+            self.__videos = None
+            self.__editions = None
+            self.__bonuses = None
 
             # data segment
             self.__isUsingDosBox = data.get('isUsingDosBox', False)
@@ -679,29 +908,22 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
                 else data['inDevelopment'].get('active', False)
             self.__additionalRequirements = data.get('additionalRequirements', '').strip()
             self.__links = Links(data['_links'])
-            self.__requiresGames = list(
-                map(lambda x: get_id_from_url(x['href']), data['_links'].get('requiresGames', [])))
-            self.__requiredByGames = list(
-                map(lambda x: get_id_from_url(x['href']), data['_links'].get('isRequiredByGames', [])))
-            self.__includesGames = list(
-                map(lambda x: get_id_from_url(x['href']), data['_links'].get('includesGames', [])))
-            self.__includedInGames = list(
-                map(lambda x: get_id_from_url(x['href']), data['_links'].get('isIncludedInGames', [])))
+            self.__links_data = data['_links']
+            self.__requiresGames = None
+            self.__requiredByGames = None
+            self.__includesGames = None
+            self.__includedInGames = None
 
     def __parse_ext_data(self, data):
         self.__slug = data.get('slug', '').strip()
 
-        content_system_compatibility = list()
-        for os in data['content_system_compatibility'].keys():
-            if data['content_system_compatibility'][os]:
-                content_system_compatibility.append({'name': os})
-        self.__content_system_compatibility = list(map(lambda x: OS(x), content_system_compatibility))
-
-        downloads = data.get('downloads', {})
-        self.__installers = list(map(lambda x: Installer(self.slug, x), downloads.get('installers', [])))
-        self.__bonusContent = list(map(lambda x: BonusContent(self.slug, x), downloads.get('bonus_content', [])))
-        self.__patches = list(map(lambda x: Patche(self.slug, x), downloads.get('patches', [])))
-        self.__languagePacks = list(map(lambda x: LanguagePack(self.slug, x), downloads.get('language_packs', [])))
+        # built from raw data on first access
+        self.__ext_data = data
+        self.__content_system_compatibility = None
+        self.__installers = None
+        self.__bonusContent = None
+        self.__patches = None
+        self.__languagePacks = None
 
     def __parse_rating_data(self, data):
         self.__averageRating = Rating(data)
@@ -772,3 +994,4 @@ class GOGProduct(GOGBase, GOGNeedNetworkMetaClass):
                 'initialized': True,
                 'detailCheckout': now,
                 'detailUpdate': now})
+        DB.Game[self.id].payloadHash = self.fingerprint()
@@ -2,7 +2,13 @@
 
 from datetime import datetime
 from .gogapi import API
+from .gogexceptions import GOGLoginError, GOGNotFound, GOGNetworkError, GOGTooManyRequests, GOGUnauthorized, \
+    GOGTokenExpired, GOGRefreshRejected
+from .utilities import HostLimiter, RetryPolicy
 import asyncio
+import logging
+import os
+import time
 import simplejson as json
 
 
@@ -18,8 +24,13 @@ def datetime_decoder(dct):
 
 
 class GOGToken:
+    """
+    GOG access token, in a running event loop use get_access_token,
+    it refreshes the token under a lock so concurrent callers share one refresh,
+    start_auto_refresh keeps the token fresh in background refresh_margin seconds before expiry
+    """
 
-    def __init__(self, autosave=True):
+    def __init__(self, autosave=True, refresh_margin=300):
         self.__expires_in = 3600
         self.__scope = ''
         self.__token_type = ''
@@ -32,12 +43,40 @@ class GOGToken:
         self.__token_file = 'token.json'
         self.__is_autosave = autosave
 
+        self.__refresh_margin = refresh_margin
+        self.__lock = None
+        self.__refresh_task = None
+        self.__pending_refresh = None
+        self.__logger = logging.getLogger('GOGDB.GOGToken')
+
         self.__api = API()
 
     @property
     def access_token(self):
+        """
+        current access token, never blocks a running event loop,
+        a single refresh is scheduled in background if the token expires soon there,
+        GOGTokenExpired is raised there if it already expired, await get_access_token instead
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if self.is_expired():
+                self.refresh()
+            return self.__access_token
+        if self.is_expired(self.__refresh_margin) and \
+                (self.__pending_refresh is None or self.__pending_refresh.done()):
+            self.__pending_refresh = asyncio.ensure_future(self.__background_refresh())
         if self.is_expired():
-            self.refresh()
+            raise GOGTokenExpired()
+        return self.__access_token
+
+    async def get_access_token(self):
+        """
+        :return: access token, refreshed first if it expires within refresh_margin seconds
+        """
+        if self.is_expired(self.__refresh_margin):
+            await self.async_refresh()
         return self.__access_token
 
     @property
@@ -72,7 +111,8 @@ class GOGToken:
             'last_update': self.__last_update
         }
 
-    def load(self, **kwargs):
+    def load(self, save=True, **kwargs):
+        changed = kwargs['access_token'] != self.__access_token or kwargs['refresh_token'] != self.__refresh_token
         self.__expires_in = kwargs['expires_in']
         self.__scope = kwargs['scope']
         self.__token_type = kwargs['token_type']
@@ -82,7 +122,7 @@ class GOGToken:
         self.__session_id = kwargs['session_id']
         self.__last_update = kwargs['last_update']
 
-        if self.__is_autosave:
+        if self.__is_autosave and save and changed:
             self.save_to_file()
 
     def load_from_file(self, filename=None):
@@ -92,19 +132,27 @@ class GOGToken:
             self.__token_file = filename
         with open(filename, 'r') as tkfile:
             data = json.load(tkfile, object_hook=datetime_decoder)
-            self.load(**data)
+            self.load(save=False, **data)
 
     def save_to_file(self, filename=None):
         if filename is None:
             filename = self.__token_file
         else:
             self.__token_file = filename
-        with open(filename, 'w') as tkfile:
+        # write to temp file then rename, never leave a truncated token file
+        tmp_filename = f'{filename}.tmp'
+        with open(tmp_filename, 'w') as tkfile:
             json.dump(self.to_dict(), tkfile, default=datetime_encoder)
+        os.replace(tmp_filename, filename)
 
-    def is_expired(self):
-        tdelta = datetime.utcnow() - self.__last_update
-        if tdelta.total_seconds() + 10 >= self.__expires_in:
+    def expires_after(self):
+        """
+        :return: seconds until token expires
+        """
+        return self.__expires_in - (datetime.utcnow() - self.__last_update).total_seconds()
+
+    def is_expired(self, margin=10):
+        if self.expires_after() <= margin:
             return True
         else:
             return False
@@ -113,9 +161,218 @@ class GOGToken:
         try:
             loop = asyncio.new_event_loop()
             data = loop.run_until_complete(self.__api.refresh_token(self.__refresh_token))
+            loop.run_until_complete(self.__api.close())
             loop.close()
             self.load(**data)
-            if self.__is_autosave:
-                self.save_to_file()
         except Exception:
             raise
+
+    async def async_refresh(self, force=False):
+        """
+        refresh token in running event loop, only one refresh runs at a time
+        :param force: refresh even if token is still fresh
+        """
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            # another caller may have refreshed while waiting for the lock
+            if not force and not self.is_expired(self.__refresh_margin):
+                return
+            self.__logger.info(f'Refresh token of user {self.__user_id}')
+            data = await self.__api.refresh_token(self.__refresh_token)
+            self.load(**data)
+
+    async def __background_refresh(self):
+        try:
+            await self.async_refresh()
+        except Exception as e:
+            self.__logger.warning(f'Refresh token failed: {e}')
+
+    def start_auto_refresh(self):
+        """
+        refresh token in background refresh_margin seconds before expiry, need running event loop
+        """
+        if self.__refresh_task is None or self.__refresh_task.done():
+            self.__refresh_task = asyncio.ensure_future(self.__auto_refresh())
+        return self.__refresh_task
+
+    async def stop_auto_refresh(self):
+        if self.__refresh_task is not None:
+            self.__refresh_task.cancel()
+            try:
+                await self.__refresh_task
+            except asyncio.CancelledError:
+                pass
+            self.__refresh_task = None
+
+    async def __auto_refresh(self):
+        while True:
+            delay = self.expires_after() - self.__refresh_margin
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.async_refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.__logger.warning(f'Refresh token failed: {e}, retry in 30 seconds')
+                await asyncio.sleep(30)
+
+
+class TokenPool:
+    """
+    GOG accounts loaded from a directory of token files, spread authenticated requests over them,
+    every account has own rate limiter, throttled accounts rest for cooldown seconds,
+    so do accounts whose refresh failed by network errors or throttling,
+    accounts whose access or refresh token is rejected are removed from rotation
+    """
+    def __init__(self, directory: str = 'tokens', cooldown: float = 600, limiter_options: dict = None):
+        self.__directory = directory
+        self.__cooldown = cooldown
+        self.__limiter_options = {'rate': 5, 'burst': 5, 'concurrency': 4, 'max_concurrency': 16} \
+            if limiter_options is None else limiter_options
+        # 429 and 401 switch account instead of retrying with the same one
+        self.__retry_policy = RetryPolicy(fatal_statuses=RetryPolicy.FATAL_STATUSES + (429,))
+        self.__accounts = dict()
+        self.__removed = dict()
+        self.__logger = logging.getLogger('GOGDB.TokenPool')
+
+    def load(self):
+        """
+        load every *.json token file in directory
+        :return: self
+        """
+        for filename in sorted(os.listdir(self.__directory)):
+            if not filename.endswith('.json'):
+                continue
+            token = GOGToken()
+            token.load_from_file(os.path.join(self.__directory, filename))
+            self.add(token)
+        self.__logger.info(f'Loaded {len(self.__accounts)} accounts from {self.__directory}')
+        return self
+
+    def add(self, token: GOGToken):
+        self.__accounts[token.user_id] = {
+            'token': token,
+            'limiter': HostLimiter(f'account {token.user_id}', **self.__limiter_options),
+            'rest_until': 0,
+            'requests': 0,
+            'throttled': 0
+        }
+        self.__removed.pop(token.user_id, None)
+
+    def remove(self, user_id, reason: str):
+        if self.__accounts.pop(user_id, None) is not None:
+            self.__removed[user_id] = reason
+            self.__logger.warning(f'Remove account {user_id} from rotation: {reason}')
+
+    async def acquire(self):
+        """
+        wait for the least loaded account not resting
+        :return: GOGToken object, give it back with release
+        """
+        while True:
+            if len(self.__accounts) == 0:
+                raise GOGLoginError('No usable account in token pool')
+            now = time.monotonic()
+            ready = [account for account in self.__accounts.values() if account['rest_until'] <= now]
+            if len(ready) == 0:
+                await asyncio.sleep(min(account['rest_until'] for account in self.__accounts.values()) - now)
+                continue
+            account = min(ready, key=lambda x: x['limiter'].in_flight / x['limiter'].concurrency)
+            await account['limiter'].acquire()
+            account['requests'] += 1
+            return account['token']
+
+    def release(self, token: GOGToken, latency: float, exp: Exception = None):
+        """
+        :param token: token got by acquire
+        :param latency: seconds used by the request
+        :param exp: exception raised by the request, None if succeeded
+        """
+        account = self.__accounts.get(token.user_id)
+        if account is None:
+            return
+        if exp is None:
+            status = 200
+        elif isinstance(exp, GOGTooManyRequests):
+            status = 429
+            account['throttled'] += 1
+            self.__rest(token.user_id, 'throttled')
+        elif isinstance(exp, GOGNotFound):
+            status = 404
+        elif isinstance(exp, GOGNetworkError):
+            status = None
+        else:
+            status = 200
+        account['limiter'].release(latency, status)
+        if isinstance(exp, GOGUnauthorized):
+            self.remove(token.user_id, str(exp))
+
+    def __rest(self, user_id, reason: str):
+        account = self.__accounts.get(user_id)
+        if account is not None:
+            account['rest_until'] = time.monotonic() + self.__cooldown
+            self.__logger.info(f'Account {user_id} {reason}, rest for {self.__cooldown}s')
+
+    async def request(self, coro_func, attempts: int = 3):
+        """
+        run coro_func with a pooled account, switch account if it is throttled or rejected
+        :param coro_func: function receive GOGToken object and return coroutine
+        :param attempts: max accounts tried
+        :return: result of coro_func
+        """
+        for attempt in range(1, attempts + 1):
+            token = await self.acquire()
+            start_time = time.monotonic()
+            try:
+                await token.get_access_token()
+            except GOGRefreshRejected as e:
+                self.release(token, time.monotonic() - start_time, e)
+                self.remove(token.user_id, f'refresh failed: {e}')
+                continue
+            except Exception as e:
+                # trouble of auth service, the account itself may be fine, rest it instead of removing it
+                self.release(token, time.monotonic() - start_time, e)
+                if not isinstance(e, GOGTooManyRequests):
+                    self.__rest(token.user_id, f'refresh failed: {e}')
+                if attempt == attempts:
+                    raise
+                continue
+            try:
+                result = await coro_func(token)
+            except (GOGTooManyRequests, GOGUnauthorized) as e:
+                self.release(token, time.monotonic() - start_time, e)
+                if attempt == attempts:
+                    raise
+                continue
+            except Exception as e:
+                self.release(token, time.monotonic() - start_time, e)
+                raise
+            self.release(token, time.monotonic() - start_time)
+            return result
+        raise GOGLoginError('No usable account in token pool')
+
+    @property
+    def retry_policy(self):
+        return self.__retry_policy
+
+    @property
+    def accounts(self):
+        return [account['token'] for account in self.__accounts.values()]
+
+    @property
+    def removed(self):
+        return dict(self.__removed)
+
+    def to_dict(self):
+        now = time.monotonic()
+        return {
+            'accounts': {user_id: {
+                'requests': account['requests'],
+                'throttled': account['throttled'],
+                'resting': account['rest_until'] > now,
+                **account['limiter'].to_dict()
+            } for user_id, account in self.__accounts.items()},
+            'removed': self.removed
+        }
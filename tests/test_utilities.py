@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+from gogdb.utilities import HostLimiter, RateLimiter
+
+
+class HostLimiterTest(unittest.TestCase):
+
+    def test_cancelled_waiter_passes_slot_on(self):
+        async def run():
+            limiter = HostLimiter('example.com', concurrency=1, max_concurrency=1, latency_target=0.1)
+            await limiter.acquire()
+            first = asyncio.ensure_future(limiter.acquire())
+            second = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            # latency above target keeps the window at one slot, release wakes first only
+            limiter.release(1.0, 200)
+            first.cancel()
+            await asyncio.wait_for(second, 1)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(limiter.in_flight, 1)
+
+        asyncio.run(run())
+
+    def test_cancel_keeps_window(self):
+        async def run():
+            limiter = HostLimiter('example.com', concurrency=8)
+            await limiter.acquire()
+            limiter.cancel()
+            self.assertEqual(limiter.in_flight, 0)
+            self.assertEqual(limiter.concurrency, 8)
+
+        asyncio.run(run())
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_window_capped_by_connector_limit(self):
+        limiter = RateLimiter(host_options={'example.com': {'concurrency': 32, 'max_concurrency': 64}},
+                              max_concurrency=16)
+        self.assertEqual(limiter.get('example.com').concurrency, 16)
+        self.assertEqual(limiter.get('example.org').concurrency, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,10 @@ try:
     import cchardet as chardet
 except ImportError:
     import chardet
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from fake_useragent import UserAgent
 import logging
 import json
@@ -13,7 +17,17 @@ import re
 from .gogexceptions import *
 import asyncio
 import os
-from random import randint
+from random import randint, uniform
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import weakref
+import zlib
+import time
+import dateutil.parser
+from functools import lru_cache
+from yarl import URL
+from multidict import CIMultiDict, CIMultiDictProxy
+from .gogcache import ValidatorCache, validator_cache
 
 
 def random_UA():
@@ -32,32 +46,544 @@ def random_UA():
 
 fake_ua = random_UA()
 
+json_content_type_re = re.compile(r'^application/(?:[\w.+-]+?\+)?json')
+
+
+def loads_json(data):
+    """
+    parse json document, use orjson if it is installed
+    :param data: utf-8 bytes or str
+    :return: json object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 class CoroutinePool:
-    """ use this class to limit coroutine concurrency """
-    def __init__(self, concurrency: int=16, coro_list: list=[]):
+    """
+    use this class to limit coroutine concurrency
+    keep at most `concurrency` coroutines in flight, a new one is started as soon as any finished,
+    coro_list can be a list, an iterator or an async iterator, coroutines are only taken when a slot is free
+    """
+    def __init__(self, concurrency: int=16, coro_list=None):
         self.__concurrency = concurrency
-        self.__coro_list = coro_list
+        self.__coro_list = coro_list if coro_list is not None else []
+
+    async def __work(self):
+        if hasattr(self.__coro_list, '__aiter__'):
+            async for coro in self.__coro_list:
+                yield coro
+        else:
+            for coro in self.__coro_list:
+                yield coro
+
+    @staticmethod
+    def __task_result(task, return_exceptions):
+        if task.cancelled():
+            exp = asyncio.CancelledError()
+        else:
+            exp = task.exception()
+        if exp is None:
+            return task.result()
+        if not return_exceptions:
+            raise exp
+        return exp
+
+    async def iter_results(self, ordered=True, return_exceptions=True):
+        """
+        run coroutines and yield their results
+        :param ordered: yield results in input order, otherwise yield them as they complete
+        :param return_exceptions: yield exceptions as results instead of raising them
+        :return: async generator of results
+        """
+        work = self.__work()
+        running = dict()        # task -> input index
+        finished = dict()       # input index -> result, only used when ordered
+        next_index = 0
+        index = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(running) < self.__concurrency:
+                    try:
+                        coro = await work.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    running[asyncio.ensure_future(coro)] = index
+                    index += 1
+
+                if len(running) == 0:
+                    break
+
+                done, _ = await asyncio.wait(list(running.keys()), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_index = running.pop(task)
+                    result = self.__task_result(task, return_exceptions)
+                    if ordered:
+                        finished[task_index] = result
+                    else:
+                        yield result
+
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in running:
+                task.cancel()
 
     async def run_all(self, return_exceptions=True):
-        if len(self.__coro_list) <= self.__concurrency:
-            return await asyncio.gather(*self.__coro_list, return_exceptions=return_exceptions)
+        return [result async for result in self.iter_results(return_exceptions=return_exceptions)]
+
+
+class SessionPool:
+    """ share one keep-alive aiohttp session per event loop between all Requesters """
+    def __init__(self, limit: int = 100, limit_per_host: int = 16,
+                 ttl_dns_cache: int = 300, keepalive_timeout: float = 30):
+        self.__limit = limit
+        self.__limit_per_host = limit_per_host
+        self.__ttl_dns_cache = ttl_dns_cache
+        self.__keepalive_timeout = keepalive_timeout
+        self.__sessions = weakref.WeakKeyDictionary()
+        self.__logger = logging.getLogger('GOGDB.SessionPool')
+
+    def get_session(self):
+        """
+        get the session bound to current event loop, create it on first use
+        :return: aiohttp.ClientSession object
+        """
+        loop = asyncio.get_event_loop()
+        session = self.__sessions.get(loop)
+        if session is None or session.closed:
+            self.__logger.debug('Create new client session')
+            connector = aiohttp.TCPConnector(limit=self.__limit,
+                                             limit_per_host=self.__limit_per_host,
+                                             ttl_dns_cache=self.__ttl_dns_cache,
+                                             keepalive_timeout=self.__keepalive_timeout)
+            session = aiohttp.ClientSession(connector=connector)
+            self.__sessions[loop] = session
+        return session
+
+    async def close(self):
+        """ close the session bound to current event loop, call it before the loop stops """
+        loop = asyncio.get_event_loop()
+        session = self.__sessions.pop(loop, None)
+        if session is not None and not session.closed:
+            self.__logger.debug('Close client session')
+            await session.close()
+
+    @property
+    def limit(self):
+        return self.__limit
+
+    @property
+    def limit_per_host(self):
+        return self.__limit_per_host
+
+
+session_pool = SessionPool()
+
+
+class HostLimiter:
+    """
+    token bucket and AIMD concurrency window of one host
+    the window grows by one slot per window of healthy responses
+    and is halved on 429, 5xx or connection errors
+    """
+    def __init__(self, host: str, rate: float = 10, burst: int = 10, concurrency: int = 8,
+                 min_concurrency: int = 1, max_concurrency: int = 64, latency_target: float = 2.0):
+        self.__host = host
+        self.__max_rate = rate
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = burst
+        self.__last_refill = time.monotonic()
+        self.__limit = concurrency
+        self.__min_limit = min_concurrency
+        self.__max_limit = max_concurrency
+        self.__latency_target = latency_target
+        self.__latency = 0.0
+        self.__in_flight = 0
+        self.__waiters = list()
+        self.__logger = logging.getLogger('GOGDB.RateLimiter')
+
+    async def acquire(self):
+        """ wait for a free concurrency slot and a rate token """
+        while self.__in_flight >= int(self.__limit):
+            waiter = asyncio.get_event_loop().create_future()
+            self.__waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # woken then cancelled before it ran, pass the free slot on to the next waiter
+                if waiter in self.__waiters:
+                    self.__waiters.remove(waiter)
+                if waiter.done() and not waiter.cancelled():
+                    self.__wakeup()
+                raise
+            finally:
+                if waiter in self.__waiters:
+                    self.__waiters.remove(waiter)
+        self.__in_flight += 1
+        try:
+            await self.__take_token()
+        except BaseException:
+            self.__in_flight -= 1
+            self.__wakeup()
+            raise
+
+    async def __take_token(self):
+        while True:
+            now = time.monotonic()
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__last_refill) * self.__rate)
+            self.__last_refill = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return
+            await asyncio.sleep((1 - self.__tokens) / self.__rate)
+
+    def release(self, latency: float, status: int = None):
+        """
+        give back the slot taken by acquire and adjust limits
+        :param latency: seconds used by the request
+        :param status: http status code, None if the connection failed
+        """
+        self.__in_flight -= 1
+        self.__latency = latency if self.__latency == 0 else 0.8 * self.__latency + 0.2 * latency
+        if status is None or status == 429 or status >= 500:
+            self.__decrease(status)
+        elif self.__latency <= self.__latency_target:
+            self.__increase()
+        self.__wakeup()
+
+    def cancel(self):
+        """ give back the slot taken by acquire without adjusting limits """
+        self.__in_flight -= 1
+        self.__wakeup()
+
+    def __increase(self):
+        self.__limit = min(self.__max_limit, self.__limit + 1 / self.__limit)
+        self.__rate = min(self.__max_rate, self.__rate + self.__max_rate / 100)
+
+    def __decrease(self, status):
+        self.__limit = max(self.__min_limit, self.__limit / 2)
+        if status == 429:
+            self.__rate = max(self.__max_rate / 100, self.__rate / 2)
+        self.__logger.info(f'{self.__host} responded {status}, '
+                           f'limit concurrency to {int(self.__limit)} and rate to {self.__rate:.2f}/s')
+
+    def __wakeup(self):
+        free = int(self.__limit) - self.__in_flight
+        for waiter in self.__waiters[:max(free, 0)]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @property
+    def host(self):
+        return self.__host
+
+    @property
+    def rate(self):
+        return self.__rate
+
+    @property
+    def concurrency(self):
+        return int(self.__limit)
+
+    @property
+    def in_flight(self):
+        return self.__in_flight
+
+    @property
+    def latency(self):
+        return self.__latency
+
+    def to_dict(self):
+        return {
+            'rate': self.rate,
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'latency': self.latency
+        }
+
+
+class RateLimiter:
+    """ keep a HostLimiter for every host, hosts without options use the default one """
+    def __init__(self, host_options: dict = None, default_options: dict = None, max_concurrency: int = None):
+        """
+        :param max_concurrency: cap of every host window, set it to limit_per_host of the session connector,
+                                requests above it only queue inside aiohttp and inflate measured latency
+        """
+        self.__host_options = host_options if host_options is not None else dict()
+        self.__default_options = default_options if default_options is not None else dict()
+        self.__max_concurrency = max_concurrency
+        self.__limiters = dict()
+
+    def get(self, host: str):
+        if host not in self.__limiters:
+            options = dict(self.__host_options.get(host, self.__default_options))
+            if self.__max_concurrency:
+                for option, default in (('concurrency', 8), ('max_concurrency', 64)):
+                    options[option] = min(options.get(option, default), self.__max_concurrency)
+                options['min_concurrency'] = min(options.get('min_concurrency', 1), options['max_concurrency'])
+            self.__limiters[host] = HostLimiter(host, **options)
+        return self.__limiters[host]
+
+    @property
+    def limits(self):
+        """
+        live limits of every host seen so far
+        :return: dict like {<host>: {'rate':..., 'concurrency':..., 'in_flight':..., 'latency':...}}
+        """
+        return {host: limiter.to_dict() for host, limiter in self.__limiters.items()}
+
+
+rate_limiter = RateLimiter(host_options={
+    'api.gog.com': {'rate': 20, 'burst': 20, 'concurrency': 16},
+    'reviews.gog.com': {'rate': 10, 'burst': 10, 'concurrency': 8},
+    'content-system.gog.com': {'rate': 20, 'burst': 20, 'concurrency': 16},
+    # per account limits of gameplay.gog.com are kept by gogtoken.TokenPool
+    'gameplay.gog.com': {'rate': 20, 'burst': 20, 'concurrency': 8, 'max_concurrency': 32},
+}, max_concurrency=session_pool.limit_per_host)
+
+
+class RetryMetrics:
+    """ count retries and time slept by Requester, used to tune RetryPolicy """
+    def __init__(self):
+        self.__retries = 0
+        self.__sleep_time = 0.0
+        self.__gave_up = 0
+
+    def record_retry(self, delay: float):
+        self.__retries += 1
+        self.__sleep_time += delay
+
+    def record_give_up(self):
+        self.__gave_up += 1
+
+    @property
+    def retries(self):
+        return self.__retries
+
+    @property
+    def sleep_time(self):
+        return self.__sleep_time
+
+    @property
+    def gave_up(self):
+        return self.__gave_up
+
+    def to_dict(self):
+        return {
+            'retries': self.retries,
+            'sleep_time': self.sleep_time,
+            'gave_up': self.gave_up
+        }
+
+
+retry_metrics = RetryMetrics()
+
+
+class RetryPolicy:
+    """
+    exponential backoff with full jitter, honor Retry-After header
+    total time spent on one request is bounded by deadline
+    """
+    FATAL_STATUSES = (401, 403, 404)
+
+    def __init__(self, retries: int = 5, base_delay: float = 0.5, max_delay: float = 30,
+                 deadline: float = 120, metrics: RetryMetrics = None, fatal_statuses: tuple = FATAL_STATUSES):
+        """
+        :param fatal_statuses: http status codes never retried
+        """
+        self.__retries = retries
+        self.__fatal_statuses = fatal_statuses
+        self.__base_delay = base_delay
+        self.__max_delay = max_delay
+        self.__deadline = deadline
+        self.__metrics = retry_metrics if metrics is None else metrics
+
+    @staticmethod
+    def is_retryable(exp: Exception, fatal_statuses: tuple = FATAL_STATUSES):
+        if isinstance(exp, ClientResponseError):
+            return exp.status not in fatal_statuses
+        return isinstance(exp, (ClientConnectionError, ClientPayloadError))
+
+    @staticmethod
+    def parse_retry_after(headers):
+        """
+        parse Retry-After header, it is either delay seconds or http date
+        :param headers: response headers
+        :return: seconds to wait or None
+        """
+        if headers is None or hdrs.RETRY_AFTER not in headers:
+            return None
+        value = headers[hdrs.RETRY_AFTER].strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_date.tzinfo is None:
+            retry_date = retry_date.replace(tzinfo=timezone.utc)
+        return max((retry_date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+    def next_delay(self, exp: Exception, attempt: int, elapsed: float):
+        """
+        get seconds to wait before next attempt
+        :param exp: exception raised by last attempt
+        :param attempt: number of failed attempts
+        :param elapsed: seconds since the first attempt
+        :return: seconds to wait, None means give up
+        """
+        if attempt > self.__retries or not self.is_retryable(exp, self.__fatal_statuses):
+            return None
+        retry_after = self.parse_retry_after(getattr(exp, 'headers', None))
+        if retry_after is not None:
+            delay = retry_after
         else:
-            steps = range(0, len(self.__coro_list), self.__concurrency)
-            results = list()
-            for step in steps:
-                tmp_result = await asyncio.gather(*self.__coro_list[step:step+self.__concurrency],
-                                                  return_exceptions=return_exceptions)
-                results.append(tmp_result)
-            return sum(results, [])
+            delay = uniform(0, min(self.__max_delay, self.__base_delay * 2 ** (attempt - 1)))
+        if elapsed + delay > self.__deadline:
+            return None
+        return delay
+
+    @property
+    def metrics(self):
+        return self.__metrics
+
+    @property
+    def fatal_statuses(self):
+        return self.__fatal_statuses
+
+    @property
+    def retries(self):
+        return self.__retries
+
+    @property
+    def deadline(self):
+        return self.__deadline
+
+
+class RequestHooks:
+    """
+    optional hooks shared by every Requester, used for offline benchmark
+    recorder saves responses, rewrite redirects urls to a mock server,
+    a 304 answered from ValidatorCache is recorded too, with Response.unchanged set,
+    the recorder saves it as a 200 of the cached body so replay does not depend on the cache
+    """
+    def __init__(self):
+        self.__recorder = None
+        self.__rewrite = None
+
+    def set_recorder(self, recorder):
+        """
+        :param recorder: object with record(method, url, params, response) method, None to stop recording
+        """
+        self.__recorder = recorder
+
+    def set_rewrite(self, rewrite):
+        """
+        :param rewrite: callable map original url to the url really requested, None to disable
+        """
+        self.__rewrite = rewrite
+
+    @property
+    def recorder(self):
+        return self.__recorder
+
+    @property
+    def rewrite(self):
+        return self.__rewrite
+
+
+request_hooks = RequestHooks()
+
+
+class SingleFlight:
+    """
+    share one in-flight call between identical concurrent callers,
+    every caller gets the same result object, so do not modify it in place
+    """
+    def __init__(self):
+        self.__calls = dict()
+        self.__hits = 0
+        self.__misses = 0
+
+    async def do(self, key, coro_func):
+        """
+        run coro_func() unless a call with same key is in flight, then wait for that one
+        :param key: hashable call key
+        :param coro_func: callable return a coroutine
+        :return: result of the shared call
+        """
+        key = (id(asyncio.get_event_loop()), key)
+        task = self.__calls.get(key)
+        if task is not None:
+            self.__hits += 1
+        else:
+            self.__misses += 1
+            task = asyncio.ensure_future(coro_func())
+            self.__calls[key] = task
+            task.add_done_callback(lambda _: self.__calls.pop(key, None))
+        # shield the shared task, a cancelled caller must not cancel other waiters
+        return await asyncio.shield(task)
+
+    @property
+    def in_flight(self):
+        return len(self.__calls)
+
+    def to_dict(self):
+        return {
+            'hits': self.__hits,
+            'misses': self.__misses,
+            'in_flight': self.in_flight
+        }
+
+
+single_flight = SingleFlight()
+
+
+class ZlibStreamDecoder:
+    """
+    decompress zlib stream chunk by chunk while body is downloading,
+    the compressed body is never held in memory as a whole
+    """
+    def __init__(self):
+        self.__decompressor = zlib.decompressobj()
+        self.__buffer = bytearray()
+
+    def feed(self, chunk: bytes):
+        self.__buffer += self.__decompressor.decompress(chunk)
+
+    def finish(self):
+        """
+        :return: decompressed data as bytearray
+        """
+        self.__buffer += self.__decompressor.flush()
+        if not self.__decompressor.eof:
+            raise zlib.error('incomplete zlib stream')
+        return self.__buffer
 
 
 class Response:
+    chunk_size = 64 * 1024
+
     def __init__(self):
         pass
 
     @classmethod
-    async def initialize(cls, aio_response: aiohttp.ClientResponse):
+    async def initialize(cls, aio_response: aiohttp.ClientResponse, cached: dict = None,
+                         decoder=None, keep_raw: bool = False):
+        """
+        read all from aiohttp response
+        :param aio_response: aiohttp.ClientResponse object
+        :param cached: cache entry of a conditional request, used as body if response is 304 Not Modified
+        :param decoder: factory of stream decoder with feed(chunk) and finish() methods, decode body while reading
+        :param keep_raw: keep body received on the wire when decoder is used
+        :return: Response object
+        """
         self = Response()
 
         self.__method = aio_response.method
@@ -71,7 +597,27 @@ class Response:
         self.__version = aio_response.version
         self.__status = aio_response.status
         self.__reason = aio_response.reason
-        self.__body = await aio_response.read()
+        if decoder is None or aio_response.status != 200:
+            self.__body = await aio_response.read()
+            self.__raw_body = self.__body
+        else:
+            stream_decoder = decoder()
+            raw_chunks = list() if keep_raw else None
+            async for chunk in aio_response.content.iter_chunked(cls.chunk_size):
+                stream_decoder.feed(chunk)
+                if keep_raw:
+                    raw_chunks.append(chunk)
+            self.__body = stream_decoder.finish()
+            self.__raw_body = b''.join(raw_chunks) if keep_raw else None
+        self.__unchanged = False
+
+        if cached is not None and self.__status == 304:
+            headers = CIMultiDict(self.__headers)
+            if cached['content_type'] is not None:
+                headers[hdrs.CONTENT_TYPE] = cached['content_type']
+            self.__headers = CIMultiDictProxy(headers)
+            self.__body = cached['body']
+            self.__unchanged = True
 
         return self
 
@@ -100,8 +646,7 @@ class Response:
     def is_expected_content_type(response_content_type: str,
                                  expected_content_type: str):
         if expected_content_type == 'application/json':
-            json_re = re.compile(r'^application/(?:[\w.+-]+?\+)?json')
-            return json_re.match(response_content_type) is not None
+            return json_content_type_re.match(response_content_type) is not None
         return expected_content_type in response_content_type
 
     @property
@@ -157,24 +702,43 @@ class Response:
     def content(self):
         return self.__body
 
+    @property
+    def raw_content(self):
+        """ body as received on the wire, None if it was decoded while streaming and not kept """
+        return self.__raw_body
+
+    @property
+    def unchanged(self):
+        """ True if the server answered 304 and body was served from cache """
+        return self.__unchanged
+
     @property
     def json(self):
-        content_type='application/json'
         ctype = self.headers.get(hdrs.CONTENT_TYPE, '').lower()
-        if not Response.is_expected_content_type(ctype, content_type):
+        if json_content_type_re.match(ctype) is None:
             raise ContentTypeError(
                 self.__request_info,
                 (),
                 message=('Attempt to decode JSON with '
                          'unexpected mimetype: %s' % ctype),
                 headers=self.headers)
+        # RFC 7159 states that the default encoding is UTF-8, parse bytes directly
+        if 'charset=' not in ctype or 'charset=utf-8' in ctype or 'charset=utf8' in ctype:
+            return loads_json(self.__body)
         encoding = self.get_encoding()
-        return json.loads(self.__body.decode(encoding))
+        return loads_json(self.__body.decode(encoding))
 
 
 class Requester:
-    def __init__(self, retries: int = 5):
-        self.__retries = retries
+    def __init__(self, retries: int = 5, pool: SessionPool = None, limiter: RateLimiter = None,
+                 retry_policy: RetryPolicy = None, cache: ValidatorCache = None, hooks: RequestHooks = None,
+                 coalesce: SingleFlight = None):
+        self.__coalesce = single_flight if coalesce is None else coalesce
+        self.__hooks = request_hooks if hooks is None else hooks
+        self.__cache = validator_cache if cache is None else cache
+        self.__retry_policy = RetryPolicy(retries=retries) if retry_policy is None else retry_policy
+        self.__pool = session_pool if pool is None else pool
+        self.__limiter = rate_limiter if limiter is None else limiter
 
         self.__ua = fake_ua
         self.__headers = {'User-Agent': self.__ua}
@@ -184,59 +748,110 @@ class Requester:
         return f'Exception occurred on {event}: {exp}'
 
     async def __aenter__(self):
-        self.__session = aiohttp.ClientSession()
+        # sessions are owned by SessionPool, nothing to open or close per Requester
         return self
 
     async def __aexit__(self, *err):
-        await self.__session.close()
-        self.__session = None
+        pass
 
     async def request(self, method, url, params=None, data=None,
-                      json=None, cookies=None, headers=None):
+                      json=None, cookies=None, headers=None, conditional=False, decoder=None,
+                      keep_raw=False):
         retries = 0
         event_str = f'{method} {url} with params: {params}, data: {data}, json: {json}, cookies: {cookies}'
         self.__logger.debug(event_str)
 
         headers = {**self.__headers, **headers} if headers is not None else self.__headers
+        cache_key = None
+        cached = None
+        if conditional and method == 'GET':
+            cache_key = ValidatorCache.make_key(url, params)
+            cached = self.__cache.get(cache_key)
+            if cached is not None:
+                headers = dict(headers)
+                if cached['etag'] is not None:
+                    headers[hdrs.IF_NONE_MATCH] = cached['etag']
+                if cached['last_modified'] is not None:
+                    headers[hdrs.IF_MODIFIED_SINCE] = cached['last_modified']
+        host_limiter = self.__limiter.get(URL(url).host)
+        wire_url = url if self.__hooks.rewrite is None else self.__hooks.rewrite(url)
+        request_start = time.monotonic()
         while True:
             if retries != 0:
                 self.__logger.debug(f'Retry Times {retries}')
             try:
-                async with self.__session.request(method, url, params=params, data=data,
-                                           json=json,cookies=cookies,headers=headers) as aio_resp:
-                    resp =  await Response.initialize(aio_resp)
-                    # raise for status after read all from aio_resp
-                    # to avoid ssl error
-                    aio_resp.raise_for_status()
-                    return resp
+                await host_limiter.acquire()
+                start_time = time.monotonic()
+                status = None
+                cancelled = False
+                try:
+                    # take the shared session on every attempt instead of holding one,
+                    # a coalesced call may outlive the Requester that started it,
+                    # the session is closed by SessionPool.close
+                    async with self.__pool.get_session().request(method, wire_url, params=params, data=data,
+                                               json=json,cookies=cookies,headers=headers) as aio_resp:
+                        resp =  await Response.initialize(aio_resp, cached, decoder,
+                                                          keep_raw or self.__hooks.recorder is not None)
+                        status = aio_resp.status
+                        if self.__hooks.recorder is not None:
+                            self.__hooks.recorder.record(method, url, params, resp)
+                        # raise for status after read all from aio_resp
+                        # to avoid ssl error
+                        aio_resp.raise_for_status()
+                        if cache_key is not None:
+                            self.__cache.record(resp.unchanged)
+                            if status == 200:
+                                self.__cache.put(cache_key,
+                                                 resp.headers.get(hdrs.ETAG),
+                                                 resp.headers.get(hdrs.LAST_MODIFIED),
+                                                 resp.headers.get(hdrs.CONTENT_TYPE),
+                                                 resp.content)
+                        return resp
+                except asyncio.CancelledError:
+                    cancelled = True
+                    raise
+                finally:
+                    if cancelled:
+                        # cancelled by the caller, the host did nothing wrong
+                        host_limiter.cancel()
+                    else:
+                        host_limiter.release(time.monotonic() - start_time, status)
 
             except (ClientConnectionError,
                     ClientResponseError,
                     ClientPayloadError,
                     InvalidURL) as e:
                 retries += 1
-                if retries <= self.__retries and \
-                        (isinstance(e, ClientConnectionError) or
-                         (isinstance(e, ClientResponseError) and e.status != 404)):
-                    self.__logger.debug(f'Network error [ {e} ] , retry...')
+                delay = self.__retry_policy.next_delay(e, retries, time.monotonic() - request_start)
+                if delay is not None:
+                    self.__logger.debug(f'Network error [ {e} ] , retry in {delay:.2f}s...')
+                    self.__retry_policy.metrics.record_retry(delay)
+                    await asyncio.sleep(delay)
                     continue
                 else:
+                    if self.__retry_policy.is_retryable(e, self.__retry_policy.fatal_statuses):
+                        self.__retry_policy.metrics.record_give_up()
                     self.__logger.error(self.__except_str(event_str, e))
                     raise exception_wrap(e)
             except Exception as e:
                 self.__logger.error(self.__except_str(event_str, e))
                 raise exception_wrap(e)
 
-    async def get(self, url, params=None, cookies=None, headers=None):
+    async def get(self, url, params=None, cookies=None, headers=None, conditional=False, decoder=None,
+                  keep_raw=False):
         """
         use get method to request url
         :param url: request url
         :param params: get params
         :param cookies: request cookies
         :param headers: request headers
+        :param conditional: send validators of cached response, check Response.unchanged for 304
+        :param decoder: stream decoder factory like ZlibStreamDecoder, decode body chunk by chunk
+        :param keep_raw: keep body received on the wire in Response.raw_content when decoder is used
         :return: Response object
         """
-        return await self.request('GET', url, params=params, cookies=cookies, headers=headers)
+        return await self.request('GET', url, params=params, cookies=cookies, headers=headers,
+                                  conditional=conditional, decoder=decoder, keep_raw=keep_raw)
 
     async def post(self, url, data=None, json=None, cookies=None, headers=None):
         """
@@ -250,17 +865,26 @@ class Requester:
         """
         return await self.request('POST', url, data=data, json=json, cookies=cookies, headers=headers)
 
-    async def get_json(self, url, params=None, cookies=None, headers=None):
+    async def get_json(self, url, params=None, cookies=None, headers=None, conditional=False):
         """
         get json object from url
         :param url: request url
         :param params: request params
         :param cookies: request cookies
         :param headers: request headers
-        :return: json object
+        :param conditional: send validators of cached response, serve cached body on 304
+        :return: json object, shared with concurrent callers of the same url, do not modify it in place
         """
-        response = await self.get(url, params=params, cookies=cookies, headers=headers)
-        return response.json
+        async def get_json():
+            response = await self.get(url, params=params, cookies=cookies, headers=headers, conditional=conditional)
+            return response.json
+
+        if cookies is not None:
+            return await get_json()
+        key = (ValidatorCache.make_key(url, params),
+               tuple(sorted(headers.items())) if headers is not None else None,
+               conditional)
+        return await self.__coalesce.do(key, get_json)
 
 
 def exception_wrap(exp: Exception):
@@ -286,6 +910,30 @@ def get_id_from_url(url):
         return None
 
 
+# formats seen in GOG payloads that datetime.fromisoformat may not understand
+known_datetime_formats = ('%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%d %H:%M:%S')
+
+
+@lru_cache(maxsize=8192)
+def parse_datetime(date_string: str):
+    """
+    parse date string into naive datetime, timezone is dropped without conversion,
+    try datetime.fromisoformat, then known formats, then dateutil, results are cached
+    :param date_string: date string like "2015-05-18T00:00:00+03:00"
+    :return: datetime object
+    """
+    try:
+        return datetime.fromisoformat(date_string).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for date_format in known_datetime_formats:
+        try:
+            return datetime.strptime(date_string, date_format).replace(tzinfo=None)
+        except ValueError:
+            continue
+    return dateutil.parser.parse(date_string).replace(tzinfo=None)
+
+
 def get_country_code_from_url(url):
     t = re.findall('countryCode=.*', url)
     if t: